@@ -0,0 +1,409 @@
+"""AttendEase 效能基準測試
+
+產生指定規模的合成 masterdata.xlsx，端對端執行 AttendanceProcessor 並量測各階段耗時、
+每秒處理列數及記憶體峰值，結果輸出為 JSON，可與保存的基準結果比較以找出效能退步。
+
+用法：
+    python benchmark.py                                   # 執行預設規模 (small, medium)
+    python benchmark.py --case large --repeat 3
+    python benchmark.py --employees 500 --departments 8 --days 31
+    python benchmark.py --baseline bench_baseline.json    # 與基準比較，退步時回傳非零結束碼
+    python benchmark.py --save-baseline bench_baseline.json
+"""
+import sys
+import json
+import time
+import random
+import shutil
+import logging
+import argparse
+import platform
+import tempfile
+import tracemalloc
+import multiprocessing
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Dict, Any, Optional
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+import main
+from main import AttendanceProcessor
+
+
+# 預設規模
+CASES = {
+    'small': {'employees': 50, 'departments': 3, 'days': 31},
+    'medium': {'employees': 300, 'departments': 8, 'days': 31},
+    'large': {'employees': 1500, 'departments': 20, 'days': 31},
+}
+
+# 合成資料的預設密度及班別比例
+DEFAULT_OPTIONS = {
+    'leave_density': 0.03,       # 每人每日請假機率
+    'meal_density': 0.05,        # 每人每日午餐紀錄機率
+    'manual_ot_density': 0.03,   # 每人每日手動加班機率
+    'shift_mix': (0.4, 0.3, 0.3),  # A1 / A2 / B1 比例
+    'start_date': '2025-05-26',
+    'seed': 0,
+}
+
+DAY_NAMES = ['Mon.', 'Tue.', 'Wed.', 'Thu.', 'Fri.', 'Sat.', 'Sun.']
+SHIFT_HOURS = {'A1': ((7, 40), (18, 40)), 'A2': ((7, 40), (18, 40)), 'B1': ((8, 0), (18, 0))}
+
+# 與基準比較時容許的耗時增加比例
+DEFAULT_TOLERANCE = 0.15
+
+
+def _clock(base: tuple, jitter_min: int, rng: random.Random) -> str:
+    """以班別時間為中心產生打卡時間字串"""
+    moment = datetime(2000, 1, 1, *base) + timedelta(minutes=rng.randint(-jitter_min, jitter_min),
+                                                     seconds=rng.randint(0, 59))
+    return moment.strftime('%H:%M:%S')
+
+
+def generate_masterdata(path: Path, employees: int, departments: int, days: int,
+                        leave_density: float = DEFAULT_OPTIONS['leave_density'],
+                        meal_density: float = DEFAULT_OPTIONS['meal_density'],
+                        manual_ot_density: float = DEFAULT_OPTIONS['manual_ot_density'],
+                        shift_mix: tuple = DEFAULT_OPTIONS['shift_mix'],
+                        start_date: str = DEFAULT_OPTIONS['start_date'],
+                        seed: int = DEFAULT_OPTIONS['seed']) -> int:
+    """產生合成 masterdata.xlsx，回傳考勤列數"""
+    rng = random.Random(seed)
+    dates = pd.date_range(start_date, periods=days)
+    dept_names = [f"Site/DEPT {index:02d}" for index in range(departments)]
+
+    employee_rows, attendance_rows = [], []
+    leave_rows, meal_rows, manual_ot_rows = [], [], []
+
+    for index in range(employees):
+        emp_id = 8000000 + index
+        name = f"EMPLOYEE {index:05d}"
+        shift = rng.choices(['A1', 'A2', 'B1'], weights=shift_mix)[0]
+        dept = dept_names[index % departments]
+        employee_rows.append({
+            'Type': 'DL' if shift != 'B1' else 'IDL', 'Employee ID': emp_id, 'Name': name,
+            'Sex': rng.choice(['Male', 'Female']), 'Department': dept.split('/')[-1], 'Shift': shift,
+            'On board\xa0date': pd.Timestamp(start_date) - pd.Timedelta(days=365), 'Leave date': None
+        })
+
+        start, end = SHIFT_HOURS[shift]
+        for date in dates:
+            day = DAY_NAMES[date.weekday()]
+            roll = rng.random()
+            if day == 'Sun.' or roll < 0.03:
+                clock_in, clock_out = '-', '-'
+            elif roll < 0.05:
+                clock_in, clock_out = _clock(start, 20, rng), '-'
+            else:
+                clock_in, clock_out = _clock(start, 25, rng), _clock(end, 90, rng)
+            attendance_rows.append({
+                'Employee ID': emp_id, 'Name': name, 'Company / Department': dept, 'Sex': 'M',
+                'Date': date, 'Day': day, 'Shift': '(08:00:00-18:00:00)',
+                'Clock-in': clock_in, 'Clock-out': clock_out
+            })
+
+            if rng.random() < leave_density:
+                leave_rows.append({
+                    'Employee ID': emp_id, 'Name': name,
+                    'Leave Type': rng.choice(['Annual Leave', 'Sick Leave', 'Unpaid Leave(day)']),
+                    'Start Date': date, 'End Date': None, 'Days': rng.choice([1.0, 0.5]),
+                    'Hours': None, 'HR Remarks': None
+                })
+            if rng.random() < meal_density:
+                meal_rows.append({'Date': date, 'Employee ID': emp_id})
+            if rng.random() < manual_ot_density:
+                manual_ot_rows.append({'Date': date, 'Employee ID': emp_id,
+                                       'OT Minutes': rng.choice([30, 60, 90, 120])})
+
+    holiday_rows = [
+        {'Employee ID': None, 'Date': dates[min(3, days - 1)], 'Festival Name': 'Public Holiday'},
+        {'Employee ID': None, 'Date': dates[min(10, days - 1)], 'Festival Name': 'OFF'},
+    ]
+
+    sheets = {
+        'Employee': pd.DataFrame(employee_rows),
+        'Holiday': pd.DataFrame(holiday_rows, columns=['Employee ID', 'Date', 'Festival Name']),
+        'Attendance': pd.DataFrame(attendance_rows),
+        'Leave': pd.DataFrame(leave_rows, columns=['Employee ID', 'Name', 'Leave Type', 'Start Date',
+                                                   'End Date', 'Days', 'Hours', 'HR Remarks']),
+        'Meal': pd.DataFrame(meal_rows, columns=['Date', 'Employee ID']),
+        'Manual OT': pd.DataFrame(manual_ot_rows, columns=['Date', 'Employee ID', 'OT Minutes']),
+    }
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with pd.ExcelWriter(path) as writer:
+        for sheet_name, df in sheets.items():
+            df.to_excel(writer, sheet_name=sheet_name, index=False)
+    return len(attendance_rows)
+
+
+class BenchmarkProcessor(AttendanceProcessor):
+    """以暫存資料夾為基礎路徑的處理器，不寫入正式的 data / output / log"""
+
+    def __init__(self, base_path: Path):
+        self._benchmark_base = str(base_path)
+        super().__init__()
+
+    def _get_base_path(self) -> str:
+        return self._benchmark_base
+
+
+# 報告用的階段分類 (對應 AttendanceProcessor.timer 的階段名稱前綴)
+STAGE_GROUPS = {
+    'load_data': lambda stage: stage.startswith('load.'),
+    'day_typing': lambda stage: stage == 'daily.DAY TYPE',
+    'metric_columns': lambda stage: (stage.startswith('employee.') or
+                                     (stage.startswith('daily.') and stage != 'daily.DAY TYPE')),
+    'employee_reports': lambda stage: stage.startswith(('sheet.', 'workbook.', 'template.')),
+    'master_report': lambda stage: stage.startswith('master.'),
+    'data_export': lambda stage: stage.startswith('export.'),
+    'rollups': lambda stage: stage.startswith('rollup.'),
+}
+
+
+def group_stages(stages: Dict[str, Dict[str, float]]) -> Dict[str, float]:
+    """將處理器的細部階段耗時彙總為報告用的階段"""
+    return {
+        group: round(sum(item['seconds'] for stage, item in stages.items() if matches(stage)), 3)
+        for group, matches in STAGE_GROUPS.items()
+    }
+
+
+def _peak_rss_mb() -> Optional[float]:
+    """目前行程的記憶體峰值 (MB)，無法取得時回傳 None"""
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux 單位為 KB，macOS 為 bytes
+        return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+    except ImportError:
+        pass
+    try:
+        import psutil
+        info = psutil.Process().memory_info()
+        return round(getattr(info, 'peak_wset', info.rss) / (1024 * 1024), 1)
+    except ImportError:
+        return None
+
+
+class _WorkbookKeeper:
+    """代替背景存檔器：保留部門活頁簿而不存檔，供量測工作表佔用的記憶體"""
+
+    def __init__(self):
+        self.pending = []
+
+    def submit(self, workbook, path: Path):
+        self.pending.append((workbook, path))
+
+    def save_all(self):
+        """量測完成後存檔，串流模式的 write-only 活頁簿需存檔才會關閉暫存檔"""
+        for workbook, path in self.pending:
+            workbook.save(path)
+        self.pending = []
+
+
+def measure_sheet_memory(processor: AttendanceProcessor, streaming: bool = False) -> Dict[str, Any]:
+    """以 tracemalloc 量測人數最多的部門建立員工工作表 (不存檔) 時的記憶體，換算為每張工作表的 KB
+
+    peak 為建立過程的峰值 (含報表列等暫存資料)，retained 為完成後活頁簿仍佔用的記憶體。
+    """
+    dept_name, dept_group = max(processor.attendance_df.groupby('Company / Department'),
+                                key=lambda item: item[1]['Employee ID'].nunique())
+    sheets = dept_group['Employee ID'].nunique()
+    template_path = processor.template_dir / processor.EMPLOYEE_TEMPLATE_FILE
+    # 模板原型及列格式預先載入，不計入量測
+    processor._template_prototype(template_path)
+    processor.row_styles()
+
+    keeper = _WorkbookKeeper()
+    processor._saver = keeper
+    tracemalloc.start()
+    try:
+        processor._build_department_report(dept_name, dept_group, 'Benchmark', template_path,
+                                           processor.output_dir, streaming)
+        retained, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+        processor._saver = None
+    keeper.save_all()
+    return {
+        'department': dept_name, 'sheets': sheets,
+        'peak_kb_per_sheet': round(peak / 1024 / sheets, 1),
+        'retained_kb_per_sheet': round(retained / 1024 / sheets, 1),
+    }
+
+
+def run_case(name: str, params: Dict[str, Any], workers: int = 1, streaming: bool = False,
+             sheet_memory: bool = False) -> Dict[str, Any]:
+    """在暫存資料夾中產生資料並執行一次完整流程，回傳量測結果 (sheet_memory 時另量測每張工作表記憶體)"""
+    work_dir = Path(tempfile.mkdtemp(prefix=f"attendease_bench_{name}_"))
+    try:
+        shutil.copytree(Path(main.__file__).resolve().parent / 'template', work_dir / 'template')
+        rows = generate_masterdata(work_dir / 'data' / 'masterdata.xlsx', **params)
+
+        processor = BenchmarkProcessor(work_dir)
+        processor.logger.setLevel(logging.WARNING)
+
+        start = time.perf_counter()
+        processor._load_data(use_cache=False)
+        processor._process_attendance_data(workers=workers, streaming=streaming)
+        total = time.perf_counter() - start
+
+        result = {
+            'case': name, 'params': params, 'workers': workers, 'streaming': streaming,
+            'attendance_rows': rows, 'employees': params['employees'],
+            'total_seconds': round(total, 3),
+            'rows_per_second': round(rows / total, 1) if total else None,
+            'peak_rss_mb': _peak_rss_mb(),
+            # 多行程時部門階段為各子行程耗時加總
+            'stages': group_stages(processor.timer.summary()),
+            'detailed_stages': processor.timer.summary(),
+        }
+        if sheet_memory:
+            # 於計時結束後另外量測，tracemalloc 不影響耗時結果
+            result['sheet_memory'] = measure_sheet_memory(processor, streaming)
+        return result
+    finally:
+        logging.getLogger(main.__name__).setLevel(logging.INFO)
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def run_isolated(name: str, params: Dict[str, Any], workers: int, streaming: bool,
+                 sheet_memory: bool = False) -> Dict[str, Any]:
+    """於獨立子行程執行單一情境，使記憶體峰值不受其他情境影響"""
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+        return executor.submit(run_case, name, params, workers, streaming, sheet_memory).result()
+
+
+def summarize(runs: list) -> Dict[str, Any]:
+    """多次執行取各項耗時的最小值 (較不受系統雜訊影響)"""
+    best = min(runs, key=lambda run: run['total_seconds'])
+    summary = dict(best)
+    summary['repeat'] = len(runs)
+    summary['peak_rss_mb'] = max((run['peak_rss_mb'] or 0) for run in runs) or None
+    summary['stages'] = {
+        stage: min(run['stages'][stage] for run in runs) for stage in best['stages']
+    }
+    return summary
+
+
+def compare_with_baseline(results: Dict[str, Any], baseline: Dict[str, Any],
+                          tolerance: float) -> list:
+    """與基準結果比較，回傳超出容許範圍的退步項目"""
+    regressions = []
+    for case, current in results['cases'].items():
+        previous = baseline.get('cases', {}).get(case)
+        if previous is None:
+            continue
+        # 不同的執行設定 (多行程、串流) 不具可比性
+        if (current['workers'], current['streaming']) != (previous['workers'], previous['streaming']):
+            print(f"Skip baseline comparison for {case}: run settings differ from baseline")
+            continue
+        metrics = {'total_seconds': (current['total_seconds'], previous['total_seconds'])}
+        for stage, seconds in current['stages'].items():
+            if stage in previous.get('stages', {}):
+                metrics[f"stages.{stage}"] = (seconds, previous['stages'][stage])
+        if current.get('peak_rss_mb') and previous.get('peak_rss_mb'):
+            metrics['peak_rss_mb'] = (current['peak_rss_mb'], previous['peak_rss_mb'])
+
+        comparison = {}
+        for metric, (now, before) in metrics.items():
+            ratio = now / before if before else None
+            comparison[metric] = {'current': now, 'baseline': before,
+                                  'ratio': round(ratio, 3) if ratio is not None else None}
+            # 極短的階段容易受雜訊影響，只比較 50ms 以上的項目
+            if ratio is not None and ratio > 1 + tolerance and max(now, before) >= 0.05:
+                regressions.append(f"{case} {metric}: {before} -> {now} (x{ratio:.2f})")
+        current['baseline_comparison'] = comparison
+    return regressions
+
+
+def parse_args(argv: Optional[list] = None) -> argparse.Namespace:
+    """解析命令列參數"""
+    parser = argparse.ArgumentParser(description="AttendEase 效能基準測試")
+    parser.add_argument('--case', action='append', choices=sorted(CASES),
+                        help="預設規模，可重複指定 (預設 small 及 medium)")
+    parser.add_argument('--employees', type=int, help="自訂規模：員工數")
+    parser.add_argument('--departments', type=int, default=5, help="自訂規模：部門數")
+    parser.add_argument('--days', type=int, default=31, help="自訂規模：天數")
+    parser.add_argument('--leave-density', type=float, default=DEFAULT_OPTIONS['leave_density'])
+    parser.add_argument('--meal-density', type=float, default=DEFAULT_OPTIONS['meal_density'])
+    parser.add_argument('--manual-ot-density', type=float, default=DEFAULT_OPTIONS['manual_ot_density'])
+    parser.add_argument('--shift-mix', type=float, nargs=3, metavar=('A1', 'A2', 'B1'),
+                        default=DEFAULT_OPTIONS['shift_mix'], help="班別比例")
+    parser.add_argument('--seed', type=int, default=DEFAULT_OPTIONS['seed'])
+    parser.add_argument('--repeat', type=int, default=1, help="每個情境重複次數")
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--streaming', action='store_true')
+    parser.add_argument('--sheet-memory', action='store_true',
+                        help="另以 tracemalloc 量測最大部門每張員工工作表的記憶體 (峰值及保留量)")
+    parser.add_argument('--output', default='bench_results.json', help="結果 JSON 檔")
+    parser.add_argument('--baseline', help="基準結果 JSON 檔，有退步時結束碼為 1")
+    parser.add_argument('--save-baseline', help="將本次結果另存為基準")
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                        help="容許的耗時增加比例 (預設 0.15)")
+    return parser.parse_args(argv)
+
+
+def main_cli(argv: Optional[list] = None) -> int:
+    """基準測試入口，回傳結束碼"""
+    args = parse_args(argv)
+    density = {
+        'leave_density': args.leave_density, 'meal_density': args.meal_density,
+        'manual_ot_density': args.manual_ot_density, 'shift_mix': tuple(args.shift_mix),
+        'seed': args.seed,
+    }
+
+    if args.employees:
+        cases = {'custom': {'employees': args.employees, 'departments': args.departments,
+                            'days': args.days}}
+    else:
+        cases = {name: CASES[name] for name in (args.case or ['small', 'medium'])}
+
+    results = {
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(), 'platform': platform.platform(),
+        'pandas': pd.__version__, 'cases': {}
+    }
+    for name, size in cases.items():
+        params = {**size, **density}
+        runs = []
+        for attempt in range(args.repeat):
+            run = run_isolated(name, params, args.workers, args.streaming, args.sheet_memory)
+            print(f"{name} #{attempt + 1}: {run['total_seconds']}s, "
+                  f"{run['rows_per_second']} rows/s, peak {run['peak_rss_mb']} MB")
+            if 'sheet_memory' in run:
+                memory = run['sheet_memory']
+                print(f"  {memory['department']} ({memory['sheets']} sheets): "
+                      f"peak {memory['peak_kb_per_sheet']} KB/sheet, "
+                      f"retained {memory['retained_kb_per_sheet']} KB/sheet")
+            runs.append(run)
+        results['cases'][name] = summarize(runs)
+
+    exit_code = 0
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare_with_baseline(results, baseline, args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            exit_code = 1
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2, ensure_ascii=False)
+    print(f"Results written to {args.output}")
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+        print(f"Baseline saved to {args.save_baseline}")
+
+    return exit_code
+
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
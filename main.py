@@ -1,32 +1,486 @@
-import math
-import shutil
+import json
+import pickle
+import hashlib
 import logging
+import argparse
+import cProfile
+import pstats
+import multiprocessing
+import threading
 import traceback
-from datetime import datetime, time, timedelta
+from collections import defaultdict
+from contextlib import contextmanager
+from copy import copy, deepcopy
+from time import perf_counter
+from datetime import datetime
 from typing import Dict, Any, Optional, Union
 from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 
+import numpy as np
 import pandas as pd
-import tkinter as tk
-from tkinter import messagebox
-
-from openpyxl import load_workbook
-from openpyxl.utils.dataframe import dataframe_to_rows
-from openpyxl.styles import PatternFill, Font
-from pandas import Series
-from tqdm import tqdm
 import sys
 import os
 
+# tkinter、tqdm 及 openpyxl 於實際使用時才載入，縮短啟動時間並可在無圖形介面的伺服器執行
+
+# 命令列結束碼
+EXIT_SUCCESS = 0
+EXIT_FAILURE = 1
+EXIT_MISSING_INPUT = 3
+
+
+class SheetPrototype:
+    """模板工作表的記憶體原型，可依序串流寫入 write-only 工作表
+
+    保存與 copy_worksheet 相同的內容：儲存格值與樣式、欄寬列高、合併儲存格及版面設定；
+    另保存檢視設定、註解、活頁簿佈景主題及預設字型，供 new_workbook 在記憶體中建立與模板檔相同的活頁簿。
+    """
+
+    STYLE_ATTRS = ('font', 'fill', 'border', 'alignment', 'number_format', 'protection')
+
+    def __init__(self, sheet):
+        self.title = sheet.title
+        self.max_row = sheet.max_row
+        self.max_column = sheet.max_column
+        self.cells = {}
+        self.comments = {}
+        # 相同樣式的儲存格共用同一個樣式組合，儲存格只記錄其在 styles 中的編號，寫入時依編號快取
+        self.styles = []
+        style_ids = {}
+        style_arrays = {}
+        for row in sheet.iter_rows():
+            for cell in row:
+                style_id = None
+                if cell.has_style:
+                    # 樣式索引相同的儲存格只需取出一次樣式物件
+                    style_id = style_arrays.get(tuple(cell._style))
+                    if style_id is None:
+                        style = tuple(copy(getattr(cell, attr)) for attr in self.STYLE_ATTRS)
+                        style_id = style_ids.setdefault(style, len(style_ids))
+                        if style_id == len(self.styles):
+                            self.styles.append(style)
+                        style_arrays[tuple(cell._style)] = style_id
+                if cell.value is not None or style_id is not None:
+                    self.cells[(cell.row, cell.column)] = (cell.value, style_id)
+                if cell.comment is not None:
+                    self.comments[(cell.row, cell.column)] = copy(cell.comment)
+
+        self.column_dimensions = {key: self._detach(dim) for key, dim in sheet.column_dimensions.items()}
+        self.row_dimensions = {key: self._detach(dim) for key, dim in sheet.row_dimensions.items()}
+        # 欄列的樣式索引只在模板活頁簿有效，另存樣式物件供寫入時於目標活頁簿重新註冊
+        self.dimension_styles = {
+            (kind, key): tuple(copy(getattr(dim, attr)) for attr in self.STYLE_ATTRS)
+            for kind, dims in (('column', sheet.column_dimensions), ('row', sheet.row_dimensions))
+            for key, dim in dims.items() if dim.has_style
+        }
+        self.merged_ranges = [str(merged) for merged in sheet.merged_cells.ranges]
+        self.sheet_format = copy(sheet.sheet_format)
+        self.sheet_properties = copy(sheet.sheet_properties)
+        self.page_margins = copy(sheet.page_margins)
+        self.page_setup = copy(sheet.page_setup)
+        self.print_options = copy(sheet.print_options)
+        self.views = copy(sheet.views)
+        self.theme = sheet.parent.loaded_theme
+        # 未設定樣式的儲存格沿用活頁簿預設字型
+        self.default_font = copy(sheet.parent._fonts[0])
+
+        self._style_workbook = None
+        self._style_cache = {}
+
+    def __getstate__(self):
+        # 傳給子行程時不帶上目前綁定的活頁簿及其樣式快取
+        state = self.__dict__.copy()
+        state['_style_workbook'] = None
+        state['_style_cache'] = {}
+        return state
+
+    @classmethod
+    def from_file(cls, path: Path, sheet_name: str = 'Sheet1') -> 'SheetPrototype':
+        """從模板檔讀取指定工作表"""
+        from openpyxl import load_workbook
+        return cls(load_workbook(path)[sheet_name])
+
+    def new_workbook(self, write_only: bool = False):
+        """在記憶體中建立只含模板工作表的活頁簿，結果與複製模板檔後開啟相同，不經磁碟
+
+        write_only 時只套用佈景主題及預設字型，不建立工作表 (供 stream_to 寫入)。
+        """
+        from openpyxl import Workbook
+        from openpyxl.utils.indexed_list import IndexedList
+
+        workbook = Workbook(write_only=write_only)
+        workbook.loaded_theme = self.theme
+        workbook._fonts = IndexedList([copy(self.default_font)])
+        workbook._named_styles['Normal'].font = copy(self.default_font)
+        if write_only:
+            return workbook
+
+        sheet = workbook.active
+        sheet.title = self.title
+        sheet.views = copy(self.views)
+        self.copy_to(sheet)
+        for (r_idx, c_idx), comment in self.comments.items():
+            sheet.cell(row=r_idx, column=c_idx).comment = copy(comment)
+        return workbook
+
+    def stream_to(self, sheet, values: Dict[tuple, Any], row_styles: Dict[int, str],
+                  named_styles: Dict[str, Dict[str, Any]]):
+        """依列序將模板與資料寫入 write-only 工作表
+
+        values 為 {(row, column): value}，覆寫模板儲存格值；
+        row_styles 為 {row: 樣式名稱}，named_styles 為 {樣式名稱: {樣式屬性: 樣式}}，套用於該列所有欄位。
+        樣式快取以模板樣式編號及樣式名稱為鍵。
+        """
+        from openpyxl.cell import WriteOnlyCell
+
+        self._copy_layout(sheet)
+
+        max_row = max([self.max_row] + [row for row, _ in values] + list(row_styles))
+        max_column = max([self.max_column] + [col for _, col in values])
+
+        self._bind_styles(sheet.parent)
+
+        for r_idx in range(1, max_row + 1):
+            row_style = row_styles.get(r_idx)
+            row_cells = []
+            for c_idx in range(1, max_column + 1):
+                value, style_id = self.cells.get((r_idx, c_idx), (None, None))
+                cell = WriteOnlyCell(sheet)
+                if style_id is not None or row_style is not None:
+                    style_key = (style_id, row_style)
+                    cached = self._style_cache.get(style_key)
+                    if cached is None:
+                        if style_id is not None:
+                            for attr, attr_value in zip(self.STYLE_ATTRS, self.styles[style_id]):
+                                setattr(cell, attr, attr_value)
+                        if row_style is not None:
+                            for attr, attr_value in named_styles[row_style].items():
+                                setattr(cell, attr, attr_value)
+                        self._style_cache[style_key] = copy(cell._style)
+                    else:
+                        cell._style = copy(cached)
+                # 先套樣式再寫值，日期時間值才會如 copy_worksheet 一樣帶入對應數值格式
+                cell.value = values.get((r_idx, c_idx), value)
+                row_cells.append(cell)
+            sheet.append(row_cells)
+
+    def copy_to(self, sheet):
+        """將模板內容複製到一般 (可編輯) 工作表，結果與 copy_worksheet 相同"""
+        self._copy_layout(sheet)
+        self._bind_styles(sheet.parent)
+
+        for (r_idx, c_idx), (value, style_id) in self.cells.items():
+            cell = sheet.cell(row=r_idx, column=c_idx, value=value)
+            if style_id is None:
+                continue
+            cached = self._style_cache.get((style_id, None))
+            if cached is None:
+                for attr, attr_value in zip(self.STYLE_ATTRS, self.styles[style_id]):
+                    setattr(cell, attr, attr_value)
+                self._style_cache[(style_id, None)] = copy(cell._style)
+            else:
+                cell._style = copy(cached)
+        # 確保工作表範圍與模板一致
+        sheet.cell(row=self.max_row, column=self.max_column)
+
+    def _bind_styles(self, workbook):
+        """相同樣式組合在同一活頁簿只註冊一次，之後直接複製樣式索引"""
+        if self._style_workbook is not workbook:
+            self._style_workbook = workbook
+            self._style_cache = {}
+
+    @staticmethod
+    def _detach(dim):
+        """複製欄列設定，不保留對模板工作表的參照"""
+        dim = copy(dim)
+        dim.parent = None
+        return dim
+
+    def _copy_dimension(self, dim, sheet, key: tuple):
+        """將欄列設定綁定至目標工作表，樣式改於目標活頁簿註冊"""
+        dim = copy(dim)
+        dim.parent = sheet
+        style = self.dimension_styles.get(key)
+        if style is not None:
+            dim._style = None
+            for attr, attr_value in zip(self.STYLE_ATTRS, style):
+                setattr(dim, attr, attr_value)
+        return dim
+
+    def _copy_layout(self, sheet):
+        """複製欄寬列高、合併儲存格及版面設定"""
+        for key, dim in self.column_dimensions.items():
+            sheet.column_dimensions[key] = self._copy_dimension(dim, sheet, ('column', key))
+        for key, dim in self.row_dimensions.items():
+            sheet.row_dimensions[key] = self._copy_dimension(dim, sheet, ('row', key))
+        for merged in self.merged_ranges:
+            sheet.merged_cells.add(merged)
+        sheet.sheet_format = copy(self.sheet_format)
+        sheet.sheet_properties = copy(self.sheet_properties)
+        sheet.page_margins = copy(self.page_margins)
+        sheet.page_setup = copy(self.page_setup)
+        sheet.print_options = copy(self.print_options)
+
+
+class StageTimer:
+    """累計各處理階段的耗時與呼叫次數"""
+
+    def __init__(self):
+        self.seconds = defaultdict(float)
+        self.calls = defaultdict(int)
+
+    @contextmanager
+    def measure(self, stage: str):
+        """量測區塊耗時並累計至指定階段"""
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.seconds[stage] += perf_counter() - start
+            self.calls[stage] += 1
+
+    def merge(self, stages: Dict[str, Dict[str, float]]):
+        """併入另一份階段彙總 (例如部門或子行程回傳的結果)"""
+        for stage, item in stages.items():
+            self.seconds[stage] += item['seconds']
+            self.calls[stage] += item['calls']
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        """依階段名稱排序的 {階段: {seconds, calls}}"""
+        return {
+            stage: {'seconds': round(self.seconds[stage], 4), 'calls': self.calls[stage]}
+            for stage in sorted(self.seconds)
+        }
+
+
+class BackgroundSaver:
+    """在背景執行緒依序存檔活頁簿，與主執行緒的計算重疊
+
+    最多 max_pending 本活頁簿等待存檔，已滿時 submit 會等待，避免完成的活頁簿佔用過多記憶體。
+    """
+
+    def __init__(self, max_pending: int, logger: logging.Logger):
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='workbook-save')
+        self.slots = threading.BoundedSemaphore(max_pending)
+        self.logger = logger
+        self.timer = StageTimer()
+        self.pending = []
+
+    def submit(self, workbook, path: Path):
+        """排入存檔佇列"""
+        self.slots.acquire()
+        try:
+            future = self.executor.submit(self._save, workbook, path)
+        except BaseException:
+            self.slots.release()
+            raise
+        future.add_done_callback(lambda _: self.slots.release())
+        self.pending.append((path, future))
+
+    def _save(self, workbook, path: Path):
+        with self.timer.measure('workbook.save'):
+            workbook.save(path)
+
+    def wait(self) -> list:
+        """等待所有存檔完成並記錄失敗，回傳失敗的 [(路徑, 例外)]"""
+        self.executor.shutdown(wait=True)
+        errors = [(path, future.exception()) for path, future in self.pending if future.exception()]
+        for path, error in errors:
+            self.logger.error(f"❌ 存檔失敗 {path.name}: {error}")
+        self.pending = []
+        return errors
+
+
+class ReportRows:
+    """部門所有員工的報表列 (每日明細及週統計列)，以單一預先配置的物件陣列保存
+
+    values 依員工、日期排列，spans 為 {Employee ID: (起始列, 結束列)}，
+    info 為 {Employee ID: (Name, SHIFT, DEPARTMENT)}。
+    """
+
+    __slots__ = ('values', 'is_summary', 'is_ph', 'spans', 'info')
+
+    def __init__(self, values: np.ndarray, is_summary: np.ndarray, is_ph: np.ndarray,
+                 spans: Dict[Any, tuple], info: Dict[Any, tuple]):
+        self.values = values
+        self.is_summary = is_summary
+        self.is_ph = is_ph
+        self.spans = spans
+        self.info = info
+
+    def employee(self, emp_id) -> tuple:
+        """回傳該員工的 (報表列, 週統計列偏移, 公共假期列偏移, 員工資料)"""
+        start, stop = self.spans[emp_id]
+        return (self.values[start:stop].tolist(),
+                np.flatnonzero(self.is_summary[start:stop]).tolist(),
+                np.flatnonzero(self.is_ph[start:stop]).tolist(),
+                self.info[emp_id])
+
 
 class AttendanceProcessor:
     """考勤處理器類別"""
 
-    def __init__(self):
+    OT_BUCKETS = ['OT1.5', 'OT2.0', 'OT3.0']
+
+    # masterdata.xlsx 需要讀取的工作表，其餘工作表不解析
+    MASTERDATA_SHEETS = ['Employee', 'Attendance', 'Leave', 'Holiday', 'Meal', 'Manual OT']
+    # 固定文字欄位型別，避免 Excel 型別推斷造成同欄混型
+    MASTERDATA_DTYPES = {
+        'Clock-in': str, 'Clock-out': str, 'Day': str, 'Shift': str,
+        'Name': str, 'Company / Department': str, 'Leave Type': str
+    }
+    # 快取格式版本，解析方式變更時遞增以使舊快取失效
+    MASTERDATA_CACHE_VERSION = 2
+    # 增量執行狀態檔 (與報表一同存放於 output 資料夾) 及其格式版本
+    RUN_STATE_FILE = 'attendease_state.pkl'
+    RUN_STATE_VERSION = 1
+    # 考勤封存檔 (多年度 CSV / Parquet) 格式及每批讀取列數
+    ARCHIVE_SUFFIXES = ('.csv', '.parquet')
+    ARCHIVE_CHUNK_ROWS = 200_000
+    # 背景存檔時最多等待存檔的部門活頁簿數 (0 為在主執行緒直接存檔)
+    SAVE_QUEUE_SIZE = 2
+    # 員工工作表列格式 {樣式名稱: {樣式屬性: 樣式}}：週統計列黃底粗體、公共假期列粉色底；
+    # openpyxl 於實際使用時才載入，樣式物件由 row_styles() 首次呼叫時建立，之後所有工作表共用
+    ROW_STYLES: Optional[Dict[str, Dict[str, Any]]] = None
+    # 終端機原始打卡紀錄 (CSV) 必要欄位；工作日自班表上班前 PUNCH_DAY_START_HOURS 小時起算 24 小時，
+    # 跨日班表凌晨的下班打卡歸屬前一工作日
+    PUNCH_COLUMNS = ['Employee ID', 'Timestamp']
+    PUNCH_DAY_START_HOURS = 4
+
+    # 員工報表明細欄位 (依模板欄位順序)
+    REPORT_COLUMNS = [
+        "Date", "Day", "DAY TYPE", "Clock-in", "Clock-out", "SHIFT",
+        "LATE_MIN", "EARLY_MIN", "FORGOT_CLOCKING", "ABSENT", "WORK",
+        "LEAVE", "LVE DAYS", "MEAL", "OT", 'MANUAL OT'
+    ]
+    # 週統計加總欄位 (每日欄位 -> 月度統計器名稱)
+    SUMMARY_COLUMNS = {
+        'LATE_MIN': 'LATE_IN', 'EARLY_MIN': 'EARLY_OUT', 'FORGOT_CLOCKING': 'FORGOT_CLOCKING',
+        'ABSENT': 'ABSENT', 'WORK': 'WORK_HOURS', 'LVE DAYS': 'LVE DAYS', 'MEAL': 'MEAL',
+        'OT': 'OT_HOURS', 'MANUAL OT': 'MANUAL_OT'
+    }
+    # 月度統計加總欄位 (每日欄位 -> 月度統計器名稱)
+    MONTHLY_COLUMNS = {**SUMMARY_COLUMNS, **{bucket: bucket for bucket in OT_BUCKETS},
+                       'CANNOT_OT': 'CANNOT_OT'}
+    # 每日明細資料表 (CSV / Parquet / 純資料 xlsx) 欄位
+    DETAIL_COLUMNS = ['Employee ID', 'Name', 'Company / Department', 'DEPARTMENT',
+                      *REPORT_COLUMNS, *OT_BUCKETS, 'CANNOT_OT']
+    # 主報表欄位：月度統計器 / 員工資料欄位 -> 模板標題 (資料表輸出使用相同標題)
+    MASTER_STAT_HEADERS = {
+        'OT1.5': 'OT 1.5', 'OT2.0': 'OT 2.0', 'OT3.0': 'OT 3.0',
+        'MANUAL_OT': 'MANUAL OT', 'ABSENT': 'ABS', 'MEAL': 'MEAL',
+        'LVE DAYS': 'LVE DAYS', 'CANNOT_OT': 'CANNOT OT', 'LATE_IN': 'LATE IN',
+        'EARLY_OUT': 'EARLY OUT', 'FINAL_OT1.5': 'FINAL OT 1.5'
+    }
+    MASTER_INFO_HEADERS = {
+        'Type': 'Type', 'Employee ID': 'Employee ID', 'Name': 'Name (EN)',
+        'Department': 'Department', 'Shift': 'Shift', 'On board date': 'On board date',
+        'Leave date': 'Leave date[YYMMDD]'
+    }
+    # 部門及公司彙總欄位 (月度統計器名稱 -> 標題)，手動加班及 FINAL OT 1.5 與主報表相同以小時計
+    ROLLUP_HEADERS = {
+        'OT1.5': 'OT 1.5', 'OT2.0': 'OT 2.0', 'OT3.0': 'OT 3.0', 'MANUAL_OT': 'MANUAL OT',
+        'FINAL_OT1.5': 'FINAL OT 1.5', 'OT_HOURS': 'OT HRS', 'WORK_HOURS': 'WORK HRS',
+        'ABSENT': 'ABS', 'LVE DAYS': 'LVE DAYS', 'LATE_IN': 'LATE IN', 'EARLY_OUT': 'EARLY OUT',
+        'FORGOT_CLOCKING': 'FORGOT CLOCKING', 'MEAL': 'MEAL', 'CANNOT_OT': 'CANNOT OT'
+    }
+    # 可為空值的數值欄位，報表中以 '-' 顯示空值
+    NULLABLE_COLUMNS = ['LATE_MIN', 'EARLY_MIN', 'MANUAL OT']
+
+    # 班別規則設定檔 (放在模板資料夾)，不存在時使用 DEFAULT_SHIFT_RULES
+    SHIFT_RULES_FILE = "shift_rules.json"
+    # 星期欄位 (去空白轉小寫) 對應的查表索引，無法對應者使用最後一欄 (一般平日)
+    WEEKDAYS = ['mon.', 'tue.', 'wed.', 'thu.', 'fri.', 'sat.', 'sun.']
+    # 各列班別及星期的規則查表索引，由 _calc_daily_metrics 每份考勤資料計算一次
+    RULE_INDEX_COLUMNS = ['_SHIFT_RULE', '_DAY_RULE']
+    # 內建班別規則：defaults 為各班別共用的預設值 (亦套用於未設定的班別)，
+    # shifts 為各班別覆寫的欄位，days 可再依星期覆寫；時間為 HH:MM，時數單位為小時
+    DEFAULT_SHIFT_RULES = {
+        'defaults': {
+            'start': '08:00', 'end': '18:00', 'breaks': [], 'extra_break_hours': 0,
+            'day_type': 'WORK', 'honor_off_holidays': False,
+            'ot_eligible': False, 'ot_threshold_hours': 9, 'ot_unit_minutes': 30, 'ot_bucket': 'OT1.5',
+            'ph_base_hours': 8, 'ph_bucket': 'OT2.0', 'ph_extra_bucket': 'OT3.0',
+            'ot_min_clock_out': '18:00', 'meal_max_clock_in': '08:00', 'meal_min_clock_out': '18:00',
+            'meal_allowance': 3,
+            'days': {
+                'sat.': {'day_type': 'OT', 'ot_threshold_hours': 0},
+                'sun.': {'day_type': 'REST', 'ot_threshold_hours': 0, 'ot_bucket': 'OT2.0'},
+            },
+        },
+        'shifts': {
+            'A1': {'start': '07:40', 'end': '18:40', 'breaks': [0.83, 0.67, 0.33],
+                   'ot_eligible': True, 'honor_off_holidays': True},
+            'A2': {'start': '07:40', 'end': '18:40', 'breaks': [0.83, 0.67, 0.33],
+                   'ot_eligible': True, 'honor_off_holidays': True,
+                   'days': {'fri.': {'end': '19:40', 'extra_break_hours': 1}}},
+            'B1': {'start': '08:00', 'end': '18:00', 'breaks': [1.0],
+                   'days': {'sat.': {'day_type': 'OFF'}}},
+        },
+    }
+    # 編譯後的班別規則欄位 (欄位 -> 陣列型別)
+    SHIFT_RULE_FIELDS = {
+        'known': bool, 'start': float, 'end': float, 'break': float, 'extra_break': float,
+        'day_type': object, 'honor_off_holidays': bool,
+        'ot_eligible': bool, 'ot_threshold': float, 'ot_unit': float, 'ot_bucket': object,
+        'ph_base': float, 'ph_bucket': object, 'ph_extra_bucket': object,
+        'ot_min_clock_out': float, 'meal_max_clock_in': float, 'meal_min_clock_out': float,
+        'meal_allowance': float,
+    }
+
+    # 輸出格式 -> 副檔名：xlsx 為模板報表 (部門報表及主報表)，其餘為不含格式的資料表 (每日明細、主報表數據及部門/公司彙總)，
+    # xlsx-data 寫成單一活頁簿 (有安裝 xlsxwriter 時使用，否則以 openpyxl write-only 串流寫出)
+    EXPORT_FORMATS = {'xlsx': '.xlsx', 'csv': '.csv', 'parquet': '.parquet', 'xlsx-data': '.xlsx'}
+
+    # 模板檔名
+    EMPLOYEE_TEMPLATE_FILE = "employee_report_template.xlsx"
+    MASTER_TEMPLATE_FILE = "master_report_template.xlsx"
+    # 部門及公司彙總報表 (與主報表一同輸出，不使用模板)
+    ROLLUP_REPORT_FILE = "Rollup_Report.xlsx"
+
+    def __init__(self, input_file: Optional[Union[str, Path]] = None,
+                 template_dir: Optional[Union[str, Path]] = None,
+                 output_dir: Optional[Union[str, Path]] = None,
+                 log_dir: Optional[Union[str, Path]] = None,
+                 month: Optional[str] = None):
+        """未指定的路徑沿用程式所在資料夾下的 data / template / output / log；
+        month 為報表檔名使用的月份名稱，未指定時使用執行當下的月份"""
         self.base_path = self._get_base_path()
+        base = Path(self.base_path)
+        # 指定的輸入檔以目前工作目錄為準 (load_masterdata 的相對路徑以 data 資料夾為準)
+        self.input_file = Path(input_file).absolute() if input_file else base / 'data' / 'masterdata.xlsx'
+        self.template_dir = Path(template_dir) if template_dir else base / 'template'
+        self.output_dir = Path(output_dir) if output_dir else base / 'output'
+        self.log_dir = Path(log_dir) if log_dir else base / 'log'
+        self.cache_dir = base / 'cache'
+        self.month = month
+        # 批次執行時標示目前處理的月份及廠區 (耗時摘要檔名使用)
+        self.run_label = None
+
+        self.log_file = self._get_log_file()
         self.logger = self._setup_logging()
-        self.monthly_counters = self._init_monthly_counters()
         self.shift_rules = self._get_shift_rules()
+        self.shift_table = self._compile_shift_rules(self.shift_rules)
+        # 各階段耗時 (整體)，部門耗時另存於 department_timings
+        self.timer = StageTimer()
+        self.department_timings = {}
+        # 已解析的模板原型，批次中各月份及廠區共用
+        self._template_prototypes = {}
+        # 循序處理部門時的背景存檔器 (僅在 _run_departments 期間存在)
+        self._saver = None
+
+    @classmethod
+    def row_styles(cls) -> Dict[str, Dict[str, Any]]:
+        """員工工作表的列格式，整個類別共用同一組樣式物件"""
+        if cls.ROW_STYLES is None:
+            from openpyxl.styles import PatternFill, Font
+            cls.ROW_STYLES = {
+                'summary': {'fill': PatternFill(start_color="FFFF00", end_color="FFFF00", fill_type="solid"),
+                            'font': Font(bold=True, size=16)},
+                'ph': {'fill': PatternFill(start_color="FFC0CB", end_color="FFC0CB", fill_type="solid")},
+            }
+        return cls.ROW_STYLES
 
     def _get_base_path(self) -> str:
         """取得基礎路徑"""
@@ -34,20 +488,20 @@ class AttendanceProcessor:
             return os.path.dirname(sys.executable)
         return os.path.dirname(os.path.abspath(__file__))
 
+    def _get_log_file(self) -> Path:
+        """取得本次執行的日誌檔路徑"""
+        self.log_dir.mkdir(parents=True, exist_ok=True)
+        return self.log_dir / f"{datetime.now().strftime('%Y%m%d%H%M%S')}_attendease.log"
+
     def _setup_logging(self) -> logging.Logger:
         """設定日誌系統"""
-        log_dir = Path(self.base_path) / 'log'
-        log_dir.mkdir(exist_ok=True)
-
-        log_file = log_dir / f"{datetime.now().strftime('%Y%m%d%H%M%S')}_attendease.log"
-
         logger = logging.getLogger(__name__)
         logger.setLevel(logging.INFO)
 
         if not logger.hasHandlers():
             formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
 
-            file_handler = logging.FileHandler(log_file, encoding='utf-8')
+            file_handler = logging.FileHandler(self.log_file, encoding='utf-8')
             file_handler.setFormatter(formatter)
 
             console_handler = logging.StreamHandler()
@@ -68,223 +522,464 @@ class AttendanceProcessor:
         }
 
     def _get_shift_rules(self) -> Dict[str, Dict]:
-        """取得班別規則"""
-        return {
-            'A1': {
-                'start': time(7, 40), 'end': time(18, 40),
-                'break': 0.83 + 0.67 + 0.33, 'friday_end': time(18, 40)
-            },
-            'A2': {
-                'start': time(7, 40), 'end': time(18, 40),
-                'break': 0.83 + 0.67 + 0.33, 'friday_end': time(19, 40)
-            },
-            'B1': {
-                'start': time(8, 0), 'end': time(18, 0),
-                'break': 1.0, 'friday_end': None
-            }
-        }
-
-    def load_excel_file(self, filename: str) -> Dict[str, pd.DataFrame]:
-        """載入Excel檔案"""
-        path = Path(self.base_path) / 'data' / filename
-        return pd.read_excel(path, sheet_name=None)
-
-    def calc_late(self, row: Series) -> Union[str, int]:
-        """計算遲到分鐘數"""
-        if pd.isna(row['Clock-in']):
-            return "-"
-
-        idl_work_start = time(8, 0)
-        if row['Clock-in'] > idl_work_start and row['DAY TYPE'] in ['WORK', 'OT']:
-            late_min = (datetime.combine(datetime.today(), row['Clock-in']) -
-                        datetime.combine(datetime.today(), idl_work_start)).seconds // 60
-            return late_min
-        return "-"
-
-    def calc_early(self, row: Series) -> Union[str, int]:
-        """計算早退分鐘數"""
-        if pd.isna(row['Clock-out']):
-            return "-"
-
-        idl_work_end = time(18, 0)
-        if row['Clock-out'] < idl_work_end and row['DAY TYPE'] in ['WORK', 'OT']:
-            return (datetime.combine(datetime.today(), idl_work_end) -
-                    datetime.combine(datetime.today(), row['Clock-out'])).seconds // 60
-        return "-"
-
-    def calc_work_hours(self, row: Series) -> float:
-        """計算工作時數"""
-        if pd.isna(row['Clock-in']) or pd.isna(row['Clock-out']):
-            return 0.0
-
-        shift_code = self.map_shift(row)
-        shift_info = self.shift_rules.get(shift_code)
-
-        if not shift_info:
-            return 0.0
-
-        is_friday = row.get('Day', '').strip().lower() == 'fri.'
-        scheduled_start = shift_info['start']
-        total_break = shift_info['break']
-
-        actual_start = max(row['Clock-in'], scheduled_start)
-        actual_end = row['Clock-out']
-
-        work_start_dt = datetime.combine(datetime.today(), actual_start)
-        work_end_dt = datetime.combine(datetime.today(), actual_end)
-
-        if actual_start > actual_end:
-            work_end_dt += timedelta(days=1)
+        """取得班別規則 (模板資料夾內的設定檔，不存在時使用內建規則)"""
+        rules_path = self.template_dir / self.SHIFT_RULES_FILE
+        if not rules_path.exists():
+            return deepcopy(self.DEFAULT_SHIFT_RULES)
+
+        with open(rules_path, encoding='utf-8') as f:
+            rules = json.load(f)
+        # 設定檔未列出的預設值沿用內建規則；defaults.days 逐一星期合併，未列出的星期及欄位亦沿用內建規則
+        builtin = deepcopy(self.DEFAULT_SHIFT_RULES['defaults'])
+        defaults = rules.get('defaults', {})
+        days = {day: {**builtin['days'].get(day, {}), **defaults.get('days', {}).get(day, {})}
+                for day in {**builtin['days'], **defaults.get('days', {})}}
+        rules['defaults'] = {**builtin, **defaults, 'days': days}
+        self.logger.info(f"📐 班別規則: {rules_path.name} ({', '.join(rules.get('shifts', {}))})")
+        return rules
+
+    def _compile_shift_rules(self, rules: Dict[str, Dict]) -> Dict[str, Any]:
+        """將班別規則編譯為 (班別, 星期) 查表陣列
+
+        每個欄位為 (班別數 + 1, 8) 的陣列：最後一列為未設定班別的預設規則，最後一欄為無法對應的星期。
+        時間轉為午夜起算秒數；extra_break 為該日另外扣除的休息時數 (extra_break_hours，如週五延後下班)。
+        """
+        defaults = {key: value for key, value in rules.get('defaults', {}).items() if key != 'days'}
+        default_days = rules.get('defaults', {}).get('days', {})
+        shifts = {str(code).strip().upper(): rule for code, rule in rules.get('shifts', {}).items()}
+
+        rows = [(rule, rule.get('days', {})) for rule in shifts.values()] + [({}, {})]
+        table = {field: np.empty((len(rows), len(self.WEEKDAYS) + 1), dtype=dtype)
+                 for field, dtype in self.SHIFT_RULE_FIELDS.items()}
+
+        for s_idx, (shift_rule, shift_days) in enumerate(rows):
+            unknown_days = set(default_days) - set(self.WEEKDAYS) | set(shift_days) - set(self.WEEKDAYS)
+            if unknown_days:
+                raise ValueError(f"Shift rule days must be one of {self.WEEKDAYS}: {sorted(unknown_days)}")
+            base = {**defaults, **{key: value for key, value in shift_rule.items() if key != 'days'}}
+            for d_idx, day in enumerate(self.WEEKDAYS + [None]):
+                rule = {**base, **default_days.get(day, {}), **shift_days.get(day, {})}
+                for key in ('ot_bucket', 'ph_bucket', 'ph_extra_bucket'):
+                    if rule[key] not in self.OT_BUCKETS:
+                        raise ValueError(f"Shift rule {key} must be one of {self.OT_BUCKETS}: {rule[key]}")
+                # 額外休息時數不可為負，否則縮短的班別反而增加工作時數
+                if rule['extra_break_hours'] < 0:
+                    raise ValueError(f"Shift rule extra_break_hours must not be negative: {rule['extra_break_hours']}")
+                values = {
+                    'known': s_idx < len(shifts),
+                    'start': self._rule_seconds(rule['start'], 'start'),
+                    'end': self._rule_seconds(rule['end'], 'end'),
+                    'break': sum(rule['breaks']),
+                    'extra_break': rule['extra_break_hours'],
+                    'day_type': rule['day_type'],
+                    'honor_off_holidays': rule['honor_off_holidays'],
+                    'ot_eligible': rule['ot_eligible'],
+                    'ot_threshold': rule['ot_threshold_hours'],
+                    'ot_unit': rule['ot_unit_minutes'],
+                    'ot_bucket': rule['ot_bucket'],
+                    'ph_base': rule['ph_base_hours'],
+                    'ph_bucket': rule['ph_bucket'],
+                    'ph_extra_bucket': rule['ph_extra_bucket'],
+                    'ot_min_clock_out': self._rule_seconds(rule['ot_min_clock_out'], 'ot_min_clock_out'),
+                    'meal_max_clock_in': self._rule_seconds(rule['meal_max_clock_in'], 'meal_max_clock_in'),
+                    'meal_min_clock_out': self._rule_seconds(rule['meal_min_clock_out'], 'meal_min_clock_out'),
+                    'meal_allowance': rule['meal_allowance'],
+                }
+                for field, value in values.items():
+                    table[field][s_idx, d_idx] = value
 
-        work_hours = (work_end_dt - work_start_dt).total_seconds() / 3600
+        table['codes'] = {code: s_idx for s_idx, code in enumerate(shifts)}
+        return table
 
-        if is_friday and shift_info['friday_end'] == time(19, 40):
-            net_hours = max(0.0, work_hours - total_break - 1.0)
+    @staticmethod
+    def _rule_seconds(value: str, field: str) -> int:
+        """規則時間 (HH:MM 或 HH:MM:SS) 轉為午夜起算秒數"""
+        value = str(value)
+        try:
+            parsed = datetime.strptime(value, '%H:%M:%S' if value.count(':') == 2 else '%H:%M')
+        except ValueError:
+            raise ValueError(f"Invalid time for shift rule {field}: {value!r}") from None
+        return parsed.hour * 3600 + parsed.minute * 60 + parsed.second
+
+    def _shift_rule_index(self, attendance_df: pd.DataFrame) -> tuple:
+        """各列班別及星期在編譯後規則表中的索引，回傳 (shift_idx, day_idx)"""
+        codes = self.shift_table['codes']
+        shift_idx = (self._normalized_shift(attendance_df).map(codes)
+                     .fillna(len(codes)).to_numpy(dtype=np.intp))
+        day_idx = (pd.Series(self._normalized_day(attendance_df))
+                   .map({day: d_idx for d_idx, day in enumerate(self.WEEKDAYS)})
+                   .fillna(len(self.WEEKDAYS)).to_numpy(dtype=np.intp))
+        return shift_idx, day_idx
+
+    def _shift_rule_values(self, attendance_df: pd.DataFrame, *fields: str) -> list:
+        """依各列的班別及星期取出編譯後的規則值，回傳與 fields 順序相同的陣列
+
+        已有 RULE_INDEX_COLUMNS 欄位時直接使用，不再重新比對班別及星期文字。
+        """
+        if all(column in attendance_df for column in self.RULE_INDEX_COLUMNS):
+            shift_idx, day_idx = (attendance_df[column].to_numpy() for column in self.RULE_INDEX_COLUMNS)
         else:
-            net_hours = max(0.0, work_hours - total_break)
-
-        return round(net_hours, 2)
-
-    def calc_ot(self, row: Series) -> float:
-        """計算加班時數"""
-        shift_code = self.map_shift(row)
-        if not shift_code:
-            return 0.0
-
-        shift_code = shift_code.strip().upper()
-        work_hours = row['WORK']
-        day = row['Day'].strip().lower()
-
-        if shift_code not in ['A1', 'A2']:
-            return 0.0
-
-        if row['DAY TYPE'] == "PH":
-            ot_units = math.floor(work_hours * 60 / 30) * 0.5
-            if ot_units > 8:
-                self.monthly_counters['OT2.0'] += 8
-                self.monthly_counters['OT3.0'] += ot_units - 8
-            else:
-                self.monthly_counters['OT2.0'] += ot_units
-            return ot_units
-
-        elif day == "sun.":
-            ot_units = math.floor(work_hours * 60 / 30) * 0.5
-            self.monthly_counters['OT2.0'] += ot_units
-            return ot_units
-
-        elif day == 'sat.':
-            ot_units = math.floor(work_hours * 60 / 30) * 0.5
-            self.monthly_counters['OT1.5'] += ot_units
-            return ot_units
+            shift_idx, day_idx = self._shift_rule_index(attendance_df)
+        return [self.shift_table[field][shift_idx, day_idx] for field in fields]
+
+    @staticmethod
+    def _clock_seconds(clock: pd.Series) -> np.ndarray:
+        """打卡時間欄位 (午夜起算秒數) 轉為浮點陣列，缺漏為 NaN"""
+        return clock.to_numpy(dtype=float, na_value=np.nan)
+
+    @staticmethod
+    def _round2(values: np.ndarray) -> np.ndarray:
+        """四捨五入至小數兩位，結果與內建 round() 一致"""
+        rounded = np.round(values, 2)
+        scaled = values * 100
+        # 接近 .5 的值以內建 round() 處理，避免浮點誤差造成進位不同
+        near_tie = np.abs(np.abs(scaled - np.floor(scaled)) - 0.5) < 1e-6
+        if near_tie.any():
+            rounded[near_tie] = [round(float(value), 2) for value in values[near_tie]]
+        return rounded
+
+    def load_excel_file(self, filename: Union[str, Path]) -> Dict[str, pd.DataFrame]:
+        """載入Excel檔案 (僅讀取所需工作表，並固定文字欄位型別；相對路徑以 data 資料夾為準)"""
+        path = Path(self.base_path) / 'data' / filename
+        return pd.read_excel(path, sheet_name=self.MASTERDATA_SHEETS, dtype=self.MASTERDATA_DTYPES)
 
+    def load_masterdata(self, filename: Union[str, Path], use_cache: bool = True) -> Dict[str, pd.DataFrame]:
+        """載入並解析 masterdata，解析結果依檔案修改時間及雜湊值快取於 cache 資料夾"""
+        path = Path(self.base_path) / 'data' / filename
+        # 不同資料夾的同名檔案各自快取
+        path_key = hashlib.sha1(str(path.resolve()).encode('utf-8')).hexdigest()[:8]
+        cache_path = self.cache_dir / f"{path.stem}_{path_key}.pkl"
+        stat = path.stat()
+
+        cached = self._read_pickle(cache_path, self.MASTERDATA_CACHE_VERSION) if use_cache else None
+        if cached and cached['mtime'] == stat.st_mtime_ns and cached['size'] == stat.st_size:
+            self.logger.info(f"⚡ 使用快取資料: {cache_path.name}")
+            return cached['frames']
+
+        digest = self._file_digest(path)
+        if cached and cached['sha256'] == digest:
+            # 檔案僅修改時間變動，內容相同
+            self.logger.info(f"⚡ 使用快取資料: {cache_path.name}")
+            frames = cached['frames']
         else:
-            ot_hours = max(0, work_hours - 9)
-            ot_units = math.floor(ot_hours * 60 / 30) * 0.5
-            self.monthly_counters['OT1.5'] += ot_units
-            return ot_units
-
-    def map_shift(self, row: Series) -> Optional[str]:
-        """判斷班別"""
-        emp_info = self.employee_df.loc[self.employee_df['Employee ID'] == row['Employee ID']]
-        if emp_info.empty:
+            frames = self._parse_masterdata(filename)
+
+        if use_cache:
+            self._write_pickle(cache_path, {
+                'version': self.MASTERDATA_CACHE_VERSION,
+                'mtime': stat.st_mtime_ns, 'size': stat.st_size, 'sha256': digest,
+                'frames': frames
+            })
+        return frames
+
+    def _parse_masterdata(self, filename: str) -> Dict[str, pd.DataFrame]:
+        """讀取 Excel 並完成格式轉換 (打卡時間轉為午夜起算秒數)"""
+        xls = self.load_excel_file(filename)
+
+        attendance_df = xls['Attendance']
+        attendance_df['Clock-in'] = self._parse_clock(attendance_df['Clock-in'])
+        attendance_df['Clock-out'] = self._parse_clock(attendance_df['Clock-out'])
+
+        # 以 (Employee ID, Date) 對應的工作表統一鍵值型別，避免單一格式錯誤的儲存格使對應失敗
+        id_dtype = attendance_df['Employee ID'].dtype
+        for sheet, date_column in (('Leave', 'Start Date'), ('Holiday', 'Date'),
+                                   ('Meal', 'Date'), ('Manual OT', 'Date')):
+            xls[sheet] = self._normalize_record_keys(xls[sheet], sheet, date_column, id_dtype)
+        xls['Leave']['End Date'] = self._excel_dates(xls['Leave']['End Date'])
+        return xls
+
+    def _normalize_record_keys(self, records_df: pd.DataFrame, sheet: str, date_column: str,
+                               id_dtype) -> pd.DataFrame:
+        """日期欄轉為日期、Employee ID 轉為 Attendance 工作表的型別
+
+        無法轉換的列 (及沒有日期的列) 無法對應任何考勤，直接略過並記錄筆數；
+        Employee ID 空白的列保留 (Holiday 工作表的一般假期)。
+        """
+        records_df = records_df.copy()
+        dates = self._excel_dates(records_df[date_column])
+        ids = records_df['Employee ID']
+        if pd.api.types.is_numeric_dtype(id_dtype):
+            text = ids.where(ids.map(lambda value: not isinstance(value, str)), ids.astype(str).str.strip())
+            converted = pd.to_numeric(text, errors='coerce')
+        else:
+            converted = ids.map(lambda value: value if pd.isna(value) else
+                                str(int(value)) if isinstance(value, float) and value.is_integer() else
+                                str(value).strip())
+        invalid = dates.isna() | (ids.notna() & converted.isna())
+        if invalid.any():
+            self.logger.warning(f"⚠️ {sheet}: {int(invalid.sum())} rows skipped (invalid Employee ID or {date_column})")
+        records_df[date_column] = dates
+        records_df['Employee ID'] = converted
+        return records_df[~invalid].reset_index(drop=True)
+
+    @staticmethod
+    def _parse_clock(clock: pd.Series) -> pd.Series:
+        """打卡時間文字轉為午夜起算秒數 (Int32，無法解析為缺值)"""
+        parsed = pd.to_datetime(clock, format='%H:%M:%S', errors='coerce')
+        # 非 HH:MM:SS 格式 (如含日期) 再以一般解析處理
+        retry = parsed.isna() & clock.notna()
+        if retry.any():
+            parsed[retry] = pd.to_datetime(clock[retry], format='mixed', errors='coerce')
+        seconds = parsed.dt.hour * 3600 + parsed.dt.minute * 60 + parsed.dt.second
+        return seconds.astype('Int32')
+
+    @staticmethod
+    def _seconds_to_time(seconds: pd.Series) -> pd.Series:
+        """午夜起算秒數轉回 time 物件，缺值為 NaT"""
+        clock = pd.to_datetime(seconds.fillna(0).astype('int64'), unit='s').dt.time
+        return clock.where(seconds.notna(), pd.NaT)
+
+    @staticmethod
+    def _file_digest(path: Path) -> str:
+        """計算檔案內容的 SHA-256"""
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+        return digest.hexdigest()
+
+    def _read_pickle(self, path: Path, version: int) -> Optional[Dict[str, Any]]:
+        """讀取快取或狀態檔，不存在、版本不符或損毀時回傳 None"""
+        if not path.exists():
             return None
-        return emp_info.iloc[0]['Shift']
-
-    def map_dept(self, row: Series) -> Optional[str]:
-        """判斷部門"""
-        emp_info = self.employee_df.loc[self.employee_df['Employee ID'] == row['Employee ID']]
-        if emp_info.empty:
+        try:
+            with open(path, 'rb') as f:
+                payload = pickle.load(f)
+        except Exception as e:
+            self.logger.warning(f"⚠️ {path.name} 讀取失敗，將重新產生: {str(e)}")
             return None
-        return emp_info.iloc[0]['Department']
-
-
-    def map_leave(self, row: Series) -> str:
-        """映射請假資料"""
-        record = self.leave_df[
-            (self.leave_df['Employee ID'] == row['Employee ID']) &
-            (self.leave_df['Start Date'] == row['Date'])
-            ]
-
-        if not record.empty:
-            return record.iloc[0]['Leave Type']
-
-        if (row['DAY TYPE'] == "OT" and
-                (pd.isna(row['Clock-in']) or pd.isna(row['Clock-out']) or
-                 row['Clock-out'] < time(18, 0))):
-            self.monthly_counters['CANNOT_OT'] += 1
-            return "Cannot OT"
-
-        return "-"
-
-    def map_lve_days(self, row: Series) -> float:
-        """映射請假天數"""
-        record = self.leave_df[
-            (self.leave_df['Employee ID'] == row['Employee ID']) &
-            (self.leave_df['Start Date'] == row['Date'])
-            ]
-        return record.iloc[0]['Days'] if not record.empty else 0.0
-
-    def map_meal(self, row: Series) -> int:
-        """判斷是否有午餐津貼"""
-        if pd.isna(row['Clock-in']) or pd.isna(row['Clock-out']):
-            return 0
-
-        record = self.meal_df[
-            (self.meal_df['Date'] == row['Date']) &
-            (self.meal_df['Employee ID'] == row['Employee ID'])
-            ]
-
-        if (row['DAY TYPE'] == 'WORK' and record.empty and
-                row['LATE_MIN'] == '-' and row['Clock-out'] >= time(18, 0)):
-            self.monthly_counters['MEAL'] += 3
-            return 3
-        return 0
-
-    def auto_day_type(self, row: Series) -> str:
-        """自動判斷工作日類型"""
-        shift_code = self.map_shift(row)
-        if not shift_code:
-            return 'OFF'
-
-        shift_code = shift_code.strip().upper()
-        day = row['Day']
-
-        # 檢查個人假期
-        personal_record = self.holiday_df[
-            (self.holiday_df['Employee ID'] == row['Employee ID']) &
-            (self.holiday_df['Date'] == row['Date'])
-            ]
-
-        if not personal_record.empty:
-            return personal_record.iloc[0]['Festival Name']
-
-        # 檢查一般假期
-        general_record = self.holiday_df[
-            (self.holiday_df['Employee ID'].isna()) &
-            (self.holiday_df['Date'] == row['Date'])
-            ]
-
-        if not general_record.empty:
-            festival_name = general_record.iloc[0]['Festival Name']
-            if festival_name == 'OFF' and shift_code in ['A1', 'A2']:
-                return 'OFF'
-            return 'PH'
-
-        if day == "Sun.":
-            return 'REST'
-
-        if day == "Sat.":
-            return 'OFF' if shift_code == 'B1' else 'OT'
-
-        return 'WORK'
-
-    def map_manual_ot(self, row: Series) -> Union[str, float]:
-        """映射手動加班資料"""
-        record = self.manualot_df[
-            (self.manualot_df['Employee ID'] == row['Employee ID']) &
-            (self.manualot_df['Date'] == row['Date'])
-            ]
-        return record.iloc[0]['OT Minutes'] if not record.empty else '-'
+        if not isinstance(payload, dict) or payload.get('version') != version:
+            return None
+        return payload
+
+    def _write_pickle(self, path: Path, payload: Dict[str, Any]):
+        """寫入快取或狀態檔 (先寫暫存檔再取代，避免中斷時留下不完整檔案)"""
+        try:
+            path.parent.mkdir(exist_ok=True)
+            tmp_path = path.with_suffix('.tmp')
+            with open(tmp_path, 'wb') as f:
+                pickle.dump(payload, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            self.logger.warning(f"⚠️ {path.name} 寫入失敗: {str(e)}")
+
+    def calc_late(self, attendance_df: pd.DataFrame) -> pd.Series:
+        """計算遲到分鐘數 (晚於班別上班時間)，未遲到為 NA (整批向量化)"""
+        clock_in = self._clock_seconds(attendance_df['Clock-in'])
+        [work_start] = self._shift_rule_values(attendance_df, 'start')
+        is_late = (clock_in > work_start) & attendance_df['DAY TYPE'].isin(['WORK', 'OT']).to_numpy()
+        late_min = np.where(is_late, (clock_in - work_start) // 60, np.nan)
+        return pd.Series(pd.array(late_min, dtype='Int64'), index=attendance_df.index)
+
+    def calc_early(self, attendance_df: pd.DataFrame) -> pd.Series:
+        """計算早退分鐘數 (早於班別當日下班時間)，未早退為 NA (整批向量化)"""
+        clock_out = self._clock_seconds(attendance_df['Clock-out'])
+        [work_end] = self._shift_rule_values(attendance_df, 'end')
+        is_early = (clock_out < work_end) & attendance_df['DAY TYPE'].isin(['WORK', 'OT']).to_numpy()
+        early_min = np.where(is_early, (work_end - clock_out) // 60, np.nan)
+        return pd.Series(pd.array(early_min, dtype='Int64'), index=attendance_df.index)
+
+    def calc_work_hours(self, attendance_df: pd.DataFrame) -> pd.Series:
+        """計算工作時數 (整批向量化，時間以午夜起算秒數計)"""
+        clock_in = self._clock_seconds(attendance_df['Clock-in'])
+        clock_out = self._clock_seconds(attendance_df['Clock-out'])
+
+        known, work_start, break_hours, extra_break = self._shift_rule_values(
+            attendance_df, 'known', 'start', 'break', 'extra_break')
+        valid = ~np.isnan(clock_in) & ~np.isnan(clock_out) & known
+
+        # 早於上班時間打卡以上班時間起算，下班早於上班視為跨日
+        actual_start = np.maximum(clock_in, work_start)
+        span = clock_out - actual_start
+        span = np.where(span < 0, span + 86400, span)
+        work_hours = span / 3600
+
+        # 該日額外休息時數 (如週五延後下班) 一併扣除
+        net_hours = np.maximum(0.0, work_hours - break_hours - extra_break)
+
+        work = np.zeros(len(attendance_df))
+        work[valid] = self._round2(net_hours[valid])
+        return pd.Series(work, index=attendance_df.index)
+
+    def calc_ot(self, attendance_df: pd.DataFrame) -> pd.DataFrame:
+        """計算加班時數及 OT1.5 / OT2.0 / OT3.0 分類 (整批向量化)"""
+        work_hours = attendance_df['WORK'].to_numpy(dtype=float)
+        (eligible, threshold, unit, bucket, ph_base, ph_bucket, ph_extra_bucket) = self._shift_rule_values(
+            attendance_df, 'ot_eligible', 'ot_threshold', 'ot_unit', 'ot_bucket',
+            'ph_base', 'ph_bucket', 'ph_extra_bucket')
+        is_ph = (attendance_df['DAY TYPE'] == 'PH').to_numpy()
+
+        # 公共假期全數計加班，其餘超過門檻時數才計；皆依規則的時間單位無條件捨去
+        counted = np.where(is_ph, work_hours, np.maximum(0, work_hours - threshold))
+        ot_units = np.where(eligible, np.floor(counted * 60 / unit) * (unit / 60), 0.0)
+
+        # 公共假期前 ph_base 小時與超出部分分別歸入各自的加班類別
+        regular = np.where(is_ph, 0.0, ot_units)
+        ph_base_units = np.where(is_ph, np.minimum(ot_units, ph_base), 0.0)
+        ph_extra_units = np.where(is_ph, np.maximum(ot_units - ph_base, 0), 0.0)
+
+        ot = {'OT': ot_units}
+        for ot_bucket in self.OT_BUCKETS:
+            ot[ot_bucket] = (np.where(bucket == ot_bucket, regular, 0.0) +
+                             np.where(ph_bucket == ot_bucket, ph_base_units, 0.0) +
+                             np.where(ph_extra_bucket == ot_bucket, ph_extra_units, 0.0))
+        return pd.DataFrame(ot, index=attendance_df.index)
+
+    def map_shift(self, attendance_df: pd.DataFrame) -> pd.Series:
+        """判斷班別 (整批，查無員工時為 None)"""
+        return self._employee_field_or_none(attendance_df, 'Shift')
+
+    def map_dept(self, attendance_df: pd.DataFrame) -> pd.Series:
+        """判斷部門 (整批，查無員工時為 None)"""
+        return self._employee_field_or_none(attendance_df, 'Department')
+
+    def map_leave(self, attendance_df: pd.DataFrame) -> pd.DataFrame:
+        """映射請假資料 (假別、請假天數、無法加班)
+
+        假別依展開後的請假區間對應；請假天數依起始日 (Start Date) 對應原請假紀錄，
+        區間內另有請假紀錄起始時兩筆天數皆計入。
+        """
+        leave = self._lookup_daily_records(attendance_df, self.leave_days_df, ['Leave Type'])
+        has_leave = (leave['_merge'] == 'both').to_numpy()
+        leave_days = self._lookup_daily_records(
+            attendance_df, self.leave_df.rename(columns={'Start Date': 'Date'}), ['Days'])
+        has_leave_days = (leave_days['_merge'] == 'both').to_numpy()
+
+        # 加班日未打卡或早於規則時間 (預設 18:00) 下班，視為無法加班
+        clock_out = self._clock_seconds(attendance_df['Clock-out'])
+        [ot_min_clock_out] = self._shift_rule_values(attendance_df, 'ot_min_clock_out')
+        cannot_ot = (
+            ~has_leave &
+            (attendance_df['DAY TYPE'] == 'OT').to_numpy() &
+            (attendance_df['Clock-in'].isna().to_numpy() | np.isnan(clock_out) |
+             (clock_out < ot_min_clock_out))
+        )
+
+        return pd.DataFrame({
+            'LEAVE': np.where(has_leave, leave['Leave Type'].to_numpy(dtype=object),
+                              np.where(cannot_ot, 'Cannot OT', '-')),
+            'LVE DAYS': np.where(has_leave_days, leave_days['Days'].to_numpy(dtype=float), 0.0),
+            'CANNOT_OT': cannot_ot.astype(int)
+        }, index=attendance_df.index)
+
+    def map_meal(self, attendance_df: pd.DataFrame) -> pd.Series:
+        """判斷是否有午餐津貼 (需先計算 MEAL RECORD)
+
+        上班打卡不晚於 meal_max_clock_in (預設 08:00)、下班不早於 meal_min_clock_out，與班別的遲到判斷無關。
+        """
+        clock_in = self._clock_seconds(attendance_df['Clock-in'])
+        clock_out = self._clock_seconds(attendance_df['Clock-out'])
+        meal_max_clock_in, meal_min_clock_out, allowance = self._shift_rule_values(
+            attendance_df, 'meal_max_clock_in', 'meal_min_clock_out', 'meal_allowance')
+        has_meal = (
+            ~np.isnan(clock_in) & ~np.isnan(clock_out) &
+            (attendance_df['DAY TYPE'] == 'WORK').to_numpy() &
+            ~attendance_df['MEAL RECORD'].to_numpy(dtype=bool) &
+            (clock_in <= meal_max_clock_in) &
+            (clock_out >= meal_min_clock_out)
+        )
+        meal = np.where(has_meal, allowance, 0)
+        # 津貼為整數時維持整數欄位
+        if np.array_equal(meal, meal.astype(int)):
+            meal = meal.astype(int)
+        return pd.Series(meal, index=attendance_df.index)
+
+    def auto_day_type(self, attendance_df: pd.DataFrame) -> pd.Series:
+        """自動判斷工作日類型 (整批向量化計算)"""
+        keys = attendance_df[['Employee ID', 'Date']]
+
+        shift = self._map_employee_field(attendance_df, 'Shift')
+        has_shift = shift.notna() & (shift != '')
+        weekday_type, honor_off_holidays = self._shift_rule_values(
+            attendance_df, 'day_type', 'honor_off_holidays')
+
+        # 個人假期：以 (Employee ID, Date) 對應
+        personal_match = self._lookup_daily_records(
+            attendance_df, self.holiday_df[self.holiday_df['Employee ID'].notna()], ['Festival Name']
+        )
+        is_personal = (personal_match['_merge'] == 'both').to_numpy()
+
+        # 一般假期：以 Date 對應
+        general = self.holiday_df.loc[
+            self.holiday_df['Employee ID'].isna(), ['Date', 'Festival Name']
+        ].drop_duplicates(subset='Date', keep='first')
+        general_match = keys[['Date']].merge(general, on='Date', how='left', indicator=True)
+        is_general = (general_match['_merge'] == 'both').to_numpy()
+
+        # 標示為 OFF 的一般假期只對採用該設定的班別放假，其餘班別視為公共假期
+        general_type = np.where(
+            (general_match['Festival Name'] == 'OFF').to_numpy() & honor_off_holidays, 'OFF', 'PH'
+        )
+
+        # 非假期依班別及星期的規則決定 (預設週六 OT、週日 REST、其餘 WORK)
+        day_type = np.select(
+            [
+                ~has_shift.to_numpy(),
+                is_personal,
+                is_general,
+            ],
+            [
+                'OFF',
+                personal_match['Festival Name'].to_numpy(dtype=object),
+                general_type.astype(object),
+            ],
+            default=weekday_type
+        )
+        return pd.Series(day_type, index=attendance_df.index, dtype=object)
+
+    def map_manual_ot(self, attendance_df: pd.DataFrame) -> pd.Series:
+        """映射手動加班資料 (分鐘，無紀錄為 NA)"""
+        manual_ot = self._lookup_daily_records(attendance_df, self.manualot_df, ['OT Minutes'])
+        minutes = pd.to_numeric(manual_ot['OT Minutes'], errors='coerce').astype('Float64')
+        return pd.Series(minutes.to_numpy(), index=attendance_df.index)
+
+    def _lookup_daily_records(self, attendance_df: pd.DataFrame, records_df: pd.DataFrame,
+                              columns: list) -> pd.DataFrame:
+        """以 (Employee ID, Date) 對應每日紀錄，重複資料以第一筆為準，_merge 欄標示是否有對應"""
+        keys = ['Employee ID', 'Date']
+        records = records_df[keys + columns].drop_duplicates(subset=keys, keep='first')
+        matched = attendance_df[keys].merge(records, on=keys, how='left', indicator=True)
+        matched.index = attendance_df.index
+        return matched
+
+    def _expand_leave_days(self) -> pd.DataFrame:
+        """將請假區間 (Start Date ~ End Date) 展開為每日一筆，供對應假別 (請假天數另依起始日對應)"""
+        leave = self.leave_df[['Employee ID', 'Leave Type', 'Start Date', 'End Date']]
+        start = leave['Start Date']
+        end = leave['End Date'].where(leave['End Date'] >= start, start)
+        span = (end - start).dt.days.fillna(0).astype(int).to_numpy() + 1
+
+        positions = np.repeat(np.arange(len(leave)), span)
+        offsets = np.arange(len(positions)) - np.repeat(np.cumsum(span) - span, span)
+
+        expanded = leave.iloc[positions].reset_index(drop=True)
+        expanded['Date'] = expanded['Start Date'] + pd.to_timedelta(offsets, unit='D')
+        return expanded
+
+    def _build_employee_index(self) -> Dict[Any, Dict[str, Any]]:
+        """建立員工索引 (Employee ID -> 員工資料)，重複ID以第一筆為準"""
+        employee_df = self.employee_df.drop_duplicates(subset='Employee ID', keep='first')
+        return employee_df.set_index('Employee ID', drop=False).to_dict('index')
+
+    def _map_employee_field(self, attendance_df: pd.DataFrame, field: str) -> pd.Series:
+        """依 Employee ID 從員工索引取出指定欄位"""
+        field_map = {emp_id: info[field] for emp_id, info in self.employee_index.items()}
+        return attendance_df['Employee ID'].map(field_map)
+
+    def _employee_field_or_none(self, attendance_df: pd.DataFrame, field: str) -> pd.Series:
+        """依 Employee ID 取出員工欄位，查無員工時為 None"""
+        values = self._map_employee_field(attendance_df, field).astype(object)
+        return values.where(attendance_df['Employee ID'].isin(self.employee_index), None)
+
+    def _normalized_shift(self, attendance_df: pd.DataFrame) -> pd.Series:
+        """取得去空白並轉大寫的班別代碼，查無員工時為空字串"""
+        shift = self._map_employee_field(attendance_df, 'Shift')
+        return shift.where(shift.notna(), '').astype(str).str.strip().str.upper()
+
+    @staticmethod
+    def _normalized_day(attendance_df: pd.DataFrame) -> np.ndarray:
+        """取得去空白並轉小寫的星期欄位"""
+        return attendance_df['Day'].astype(str).str.strip().str.lower().to_numpy()
 
     def get_col_index(self, header: list, name: str) -> Optional[int]:
         """取得欄位索引"""
@@ -307,346 +1002,1349 @@ class AttendanceProcessor:
         except Exception as e:
             self.logger.error(f"❌ 處理過程中發生錯誤: {str(e)}")
             self.logger.error(traceback.format_exc())
-            messagebox.showerror("Error", f"Error occurred：{str(e)}\nPlease check the log file for details.")
-
-    def _load_data(self):
-        """載入資料"""
-        self.logger.info("📁 讀取 masterdata.xlsx...")
-        xls = self.load_excel_file('masterdata.xlsx')
-
-        self.employee_df = xls.get('Employee')
-        self.attendance_df = xls.get('Attendance')
-        self.leave_df = xls.get('Leave')
-        self.holiday_df = xls.get('Holiday')
-        self.meal_df = xls.get('Meal')
-        self.manualot_df = xls.get('Manual OT')
-
-        # 格式轉換
-        self.attendance_df['Clock-in'] = pd.to_datetime(
-            self.attendance_df['Clock-in'], errors='coerce'
-        ).dt.time
-        self.attendance_df['Clock-out'] = pd.to_datetime(
-            self.attendance_df['Clock-out'], errors='coerce'
-        ).dt.time
-
-        self.leave_df['Start Date'] = pd.to_datetime(self.leave_df['Start Date'])
-        self.leave_df['End Date'] = pd.to_datetime(self.leave_df['End Date'])
-
-    def _process_attendance_data(self):
-        """處理考勤資料"""
+            self._show_error_message(e)
+
+    def _load_data(self, use_cache: bool = True, punch_files: Optional[list] = None,
+                   chunk_rows: Optional[int] = None):
+        """載入資料 (指定 punch_files 時考勤資料改由原始打卡紀錄產生，不使用 Attendance 工作表)"""
+        self.logger.info(f"📁 讀取 {self.input_file.name}...")
+        with self.timer.measure('load.masterdata'):
+            xls = self.load_masterdata(self.input_file, use_cache=use_cache)
+
+        self.employee_df = xls['Employee']
+        self.attendance_df = xls['Attendance']
+        self.leave_df = xls['Leave']
+        self.holiday_df = xls['Holiday']
+        self.meal_df = xls['Meal']
+        self.manualot_df = xls['Manual OT']
+
+        # 打卡時間維持午夜起算秒數 (Int32)，寫入報表時才轉回時間
+        with self.timer.measure('load.prepare'):
+            # 員工索引：每位員工只查表一次
+            self.employee_index = self._build_employee_index()
+
+            # 請假區間展開為每日資料，供 (Employee ID, Date) 對應
+            self.leave_days_df = self._expand_leave_days()
+
+        if punch_files:
+            self.attendance_df = self.load_punches(punch_files, chunk_rows=chunk_rows,
+                                                   attendance_sheet=self.attendance_df)
+
+    def load_punches(self, punch_files: list, chunk_rows: Optional[int] = None,
+                     attendance_sheet: Optional[pd.DataFrame] = None) -> pd.DataFrame:
+        """讀取終端機原始打卡紀錄 (CSV：Employee ID, Timestamp，其餘欄位如 Device 略過)，
+        整理為與 Attendance 工作表相同格式的每日考勤：工作日內最早打卡為上班、最晚為下班
+
+        檔案分批讀取，每批只保留各 (員工, 工作日) 的最早/最晚打卡及次數，記憶體用量與打卡筆數無關。
+        attendance_sheet 為 masterdata 的 Attendance 工作表，用於沿用各員工的 Company / Department 及跨日班表。
+        """
+        chunk_rows = chunk_rows or self.ARCHIVE_CHUNK_ROWS
+        keys = ['Employee ID', 'Date']
+        schedules = self._overnight_schedules(attendance_sheet)
+        pairs = None
+        total_punches = 0
+        for punch_file in punch_files:
+            self.logger.info(f"📁 讀取打卡紀錄 {Path(punch_file).name}...")
+            chunks = pd.read_csv(punch_file, usecols=self.PUNCH_COLUMNS, chunksize=chunk_rows)
+            while True:
+                with self.timer.measure('punch.read'):
+                    chunk = next(chunks, None)
+                if chunk is None:
+                    break
+                with self.timer.measure('punch.pair'):
+                    partial = self._pair_punches(chunk, schedules)
+                    pairs = partial if pairs is None else (
+                        pd.concat([pairs, partial]).groupby(level=keys)
+                        .agg({'first': 'min', 'last': 'max', 'punches': 'sum'}))
+                total_punches += len(chunk)
+
+        if pairs is None or pairs.empty:
+            raise ValueError("No valid punches found in punch logs")
+        with self.timer.measure('punch.attendance'):
+            attendance_df = self._punches_to_attendance(pairs.reset_index(), attendance_sheet, schedules)
+        self.logger.info(f"🕐 {total_punches} 筆打卡紀錄整理為 {len(attendance_df)} 筆每日考勤")
+        return attendance_df
+
+    def _overnight_schedules(self, attendance_sheet: Optional[pd.DataFrame]) -> pd.DataFrame:
+        """Attendance 工作表中最近一筆班表 (Shift 欄，如 '(19:50:00-06:40:00)') 跨午夜的員工，
+        回傳以 Employee ID 為索引的上下班秒數 (start, end)
+
+        這些員工的班別代碼可能是日班 (如 A1)，依班別規則的上班時間分日會把夜班拆在兩個工作日。
+        """
+        schedules = pd.DataFrame({'start': pd.Series(dtype=float), 'end': pd.Series(dtype=float)})
+        if attendance_sheet is None or attendance_sheet.empty or 'Shift' not in attendance_sheet:
+            return schedules
+        latest = (attendance_sheet.dropna(subset=['Shift']).sort_values('Date', kind='stable')
+                  .drop_duplicates('Employee ID', keep='last'))
+        times = latest['Shift'].astype(str).str.extract(r'(\d{1,2}:\d{2}(?::\d{2})?)\s*-\s*(\d{1,2}:\d{2}(?::\d{2})?)')
+        start = self._parse_clock(times[0]).to_numpy(dtype=float, na_value=np.nan)
+        end = self._parse_clock(times[1]).to_numpy(dtype=float, na_value=np.nan)
+        overnight = end < start
+        return pd.DataFrame({'start': start[overnight], 'end': end[overnight]},
+                            index=latest['Employee ID'].to_numpy()[overnight])
+
+    def _punch_schedule(self, punches: pd.DataFrame, schedules: pd.DataFrame, *fields: str) -> list:
+        """各列員工的班別上下班秒數：跨日班表的員工使用 schedules，其餘依班別規則 (平日)"""
+        rule_values = self._shift_rule_values(punches if 'Day' in punches else punches.assign(Day=''), *fields)
+        return [np.where(punches['Employee ID'].isin(schedules.index).to_numpy(),
+                         punches['Employee ID'].map(schedules[field]).to_numpy(dtype=float), values)
+                for field, values in zip(fields, rule_values)]
+
+    def _pair_punches(self, chunk: pd.DataFrame, schedules: pd.DataFrame) -> pd.DataFrame:
+        """單批打卡依員工班表歸入工作日，回傳各 (Employee ID, Date) 的最早、最晚打卡時間及打卡次數"""
+        timestamps = pd.to_datetime(chunk['Timestamp'], errors='coerce')
+        valid = timestamps.notna() & chunk['Employee ID'].notna()
+        if not valid.all():
+            self.logger.warning(f"⚠️ {int((~valid).sum())} punches without a valid Employee ID or Timestamp are skipped")
+        punches = pd.DataFrame({'Employee ID': chunk['Employee ID'][valid], 'Timestamp': timestamps[valid]})
+
+        # 工作日起點 = 班表上班時間前 PUNCH_DAY_START_HOURS 小時
+        start, = self._punch_schedule(punches, schedules, 'start')
+        day_offset = pd.to_timedelta(start - self.PUNCH_DAY_START_HOURS * 3600, unit='s')
+        punches['Date'] = (punches['Timestamp'] - day_offset).dt.normalize()
+        return punches.groupby(['Employee ID', 'Date'])['Timestamp'].agg(
+            first='min', last='max', punches='size')
+
+    def _punches_to_attendance(self, pairs: pd.DataFrame, attendance_sheet: Optional[pd.DataFrame] = None,
+                               schedules: Optional[pd.DataFrame] = None) -> pd.DataFrame:
+        """將每日最早/最晚打卡展開為考勤表：Employee 工作表中每位員工在打卡期間內每天一列
+        (到職前、離職後除外)，未打卡日上下班為空值，後續依規則計為缺勤"""
+        employees = self.employee_df.drop_duplicates(subset='Employee ID', keep='first')
+        # 標題可能含不換行空白 (如 'On board\xa0date')，比對前統一空白
+        employees = employees.rename(columns=lambda name: ' '.join(str(name).split())).set_index('Employee ID')
+        calendar = pd.DataFrame({'Employee ID': employees.index}).merge(
+            pd.DataFrame({'Date': pd.date_range(pairs['Date'].min(), pairs['Date'].max(), freq='D')}),
+            how='cross')
+        if 'On board date' in employees:
+            on_board = calendar['Employee ID'].map(self._excel_dates(employees['On board date']))
+            calendar = calendar[~(calendar['Date'] < on_board)]
+        if 'Leave date' in employees:
+            leave_date = calendar['Employee ID'].map(self._excel_dates(employees['Leave date']))
+            calendar = calendar[~(calendar['Date'] > leave_date)]
+
+        # 不在員工資料中的打卡仍保留，後續流程會記錄警告
+        attendance_df = (calendar.merge(pairs, on=['Employee ID', 'Date'], how='outer')
+                         .sort_values(['Employee ID', 'Date'], kind='stable').reset_index(drop=True))
+        attendance_df['punches'] = attendance_df['punches'].fillna(0)
+        attendance_df['Name'] = self._map_employee_field(attendance_df, 'Name')
+        attendance_df['Company / Department'] = self._punch_departments(attendance_df, attendance_sheet)
+        attendance_df['Day'] = attendance_df['Date'].dt.strftime('%a') + '.'
+
+        # 時間以工作日午夜起算 (跨日班別的下班時間可超過 24 小時)
+        if schedules is None:
+            schedules = self._overnight_schedules(attendance_sheet)
+        start, end = self._punch_schedule(attendance_df, schedules, 'start', 'end')
+        end = np.where(end <= start, end + 86400, end)
+        first = (attendance_df['first'] - attendance_df['Date']).dt.total_seconds().to_numpy()
+        last = (attendance_df['last'] - attendance_df['Date']).dt.total_seconds().to_numpy()
+
+        # 只打卡一次時，較接近上班時間視為上班打卡，否則視為下班打卡
+        punched = attendance_df['punches'].to_numpy() > 0
+        single_out = (attendance_df['punches'].to_numpy() == 1) & (np.abs(first - start) > np.abs(first - end))
+        clock_in = np.where(punched & ~single_out, first % 86400, np.nan)
+        clock_out = np.where(punched & ((attendance_df['punches'].to_numpy() > 1) | single_out), last % 86400, np.nan)
+        attendance_df['Clock-in'] = pd.array(np.floor(clock_in), dtype='Int32')
+        attendance_df['Clock-out'] = pd.array(np.floor(clock_out), dtype='Int32')
+
+        attendance_df['Shift'] = ('(' + self._seconds_to_time(pd.Series(start)).astype(str) + '-' +
+                                  self._seconds_to_time(pd.Series(end % 86400)).astype(str) + ')')
+        return attendance_df[['Employee ID', 'Name', 'Company / Department', 'Date', 'Day', 'Shift',
+                              'Clock-in', 'Clock-out']]
+
+    def _punch_departments(self, attendance_df: pd.DataFrame,
+                           attendance_sheet: Optional[pd.DataFrame] = None) -> pd.Series:
+        """打卡產生的考勤列的 Company / Department
+
+        沿用 masterdata Attendance 工作表中該員工最近一筆的值，部門報表及公司彙總與工作表產生的報表一致；
+        工作表中沒有該員工時，改用工作表中同一 Employee 工作表 Department 的員工最常見的 Company / Department，
+        仍無對應時才直接使用 Employee 工作表的 Department (不含公司名稱)，兩者皆記錄警告。
+        """
+        known = {}
+        if attendance_sheet is not None and not attendance_sheet.empty:
+            latest = (attendance_sheet.dropna(subset=['Company / Department'])
+                      .sort_values('Date', kind='stable').drop_duplicates('Employee ID', keep='last'))
+            known = dict(zip(latest['Employee ID'], latest['Company / Department']))
+        departments = attendance_df['Employee ID'].map(known)
+        missing = departments.isna()
+        if not missing.any():
+            return departments
+
+        # Employee 工作表 Department -> 該部門員工在工作表中最常見的 Company / Department
+        employee_departments = pd.Series({emp_id: info['Department'] for emp_id, info in self.employee_index.items()
+                                          if emp_id in known}, dtype=object)
+        derived = (pd.DataFrame({'Department': employee_departments,
+                                 'Key': employee_departments.index.map(known)})
+                   .dropna().groupby('Department')['Key'].agg(lambda keys: keys.value_counts().index[0]))
+        fallback = self._map_employee_field(attendance_df, 'Department')
+        departments = departments.where(~missing, fallback.map(derived))
+        self.logger.warning(f"⚠️ {attendance_df.loc[missing, 'Employee ID'].nunique()} employees not in the "
+                            f"Attendance sheet, grouped by the usual Company / Department of their Employee sheet Department")
+        unmapped = departments.isna()
+        if unmapped.any():
+            self.logger.warning(f"⚠️ {attendance_df.loc[unmapped, 'Employee ID'].nunique()} employees without a "
+                                f"Company / Department, grouped by Employee sheet Department")
+            departments = departments.where(~unmapped, fallback)
+        return departments
+
+    @staticmethod
+    def _excel_dates(dates: pd.Series) -> pd.Series:
+        """手動輸入的日期欄位 (到職、離職日及各工作表的日期) 轉為日期：
+        可為日期、Excel 日期序號、YYMMDD 或 ISO 文字，空白或無法解析為 NaT"""
+        if pd.api.types.is_datetime64_any_dtype(dates):
+            return dates
+        values = dates.astype(object)
+        is_date = values.map(lambda value: isinstance(value, (datetime, pd.Timestamp)))
+        parsed = pd.to_datetime(values.where(is_date), errors='coerce')
+
+        # Excel 日期序號 (如 45785) 為 5 位數，6 位數字視為 YYMMDD
+        numbers = pd.to_numeric(values.where(~is_date), errors='coerce')
+        serials = numbers[numbers < 100000].dropna()
+        parsed[serials.index] = pd.to_datetime(serials.to_numpy(), unit='D', origin='1899-12-30')
+
+        text = (values.where(~is_date & parsed.isna()).astype('string')
+                .str.strip().str.replace(r'\.0$', '', regex=True))
+        parsed = parsed.fillna(pd.to_datetime(text, format='%y%m%d', errors='coerce'))
+        return parsed.fillna(pd.to_datetime(text.where(parsed.isna()), format='ISO8601', errors='coerce'))
+
+    def _process_attendance_data(self, workers: int = 1, streaming: bool = False,
+                                 incremental: bool = False, export_formats: Optional[list] = None,
+                                 save_queue: Optional[int] = None):
+        """處理考勤資料 (workers > 1 時以多行程平行處理各部門；streaming 時以串流模式寫出部門報表；
+        incremental 時只重建輸入資料有變動的員工及部門；export_formats 為輸出格式，預設只輸出模板報表；
+        save_queue 為背景存檔佇列大小，預設 SAVE_QUEUE_SIZE)"""
         self.logger.info("📊 資料處理中...")
+        start = perf_counter()
+        export_formats = export_formats or ['xlsx']
 
         # 建立輸出資料夾
-        output_folder = Path(self.base_path) / 'output'
-        template_folder = Path(self.base_path) / 'template'
-        output_folder.mkdir(exist_ok=True)
-        template_folder.mkdir(exist_ok=True)
+        output_folder = self.output_dir
+        template_folder = self.template_dir
+        output_folder.mkdir(parents=True, exist_ok=True)
+        template_folder.mkdir(parents=True, exist_ok=True)
 
-        current_month = datetime.now().strftime('%B')
+        current_month = self.month or datetime.now().strftime('%B')
 
         # 模板路徑
-        employee_template_path = template_folder / "employee_report_template.xlsx"
-        master_template_path = template_folder / "master_report_template.xlsx"
+        employee_template_path = template_folder / self.EMPLOYEE_TEMPLATE_FILE
+        master_template_path = template_folder / self.MASTER_TEMPLATE_FILE
+        state_path = output_folder / self.RUN_STATE_FILE
+
+        if 'xlsx' in export_formats:
+            # 模板只解析一次，部門及主報表 (含子行程) 皆由記憶體中的原型建立
+            with self.timer.measure('template.load'):
+                self._template_prototype(employee_template_path)
+                self._template_prototype(master_template_path)
+
+            # 輸入指紋需在加入計算欄位前取得
+            with self.timer.measure('incremental.fingerprint'):
+                run_fingerprint = self._run_fingerprint(current_month, employee_template_path)
+                fingerprints = self._employee_fingerprints()
+                previous_state = self._load_run_state(state_path, run_fingerprint) if incremental else {}
+
+        # 整批計算每日指標
+        self._calc_daily_metrics()
+
+        rebuilt_departments = 0
+        if 'xlsx' in export_formats:
+            rebuilt_departments = self._write_template_reports(
+                output_folder, current_month, workers, streaming,
+                fingerprints, previous_state, run_fingerprint, state_path,
+                self.SAVE_QUEUE_SIZE if save_queue is None else save_queue)
+
+        # 資料表輸出不經模板，直接由每日指標及月度加總產生
+        data_formats = [fmt for fmt in export_formats if fmt != 'xlsx']
+        if data_formats:
+            self._export_data_tables(output_folder, data_formats)
+
+        self._write_timing_summary(perf_counter() - start, workers=workers, streaming=streaming,
+                                   incremental=incremental, attendance_rows=len(self.attendance_df),
+                                   rebuilt_departments=rebuilt_departments, export_formats=export_formats)
+
+    def _write_template_reports(self, output_folder: Path, current_month: str, workers: int,
+                                streaming: bool, fingerprints: Dict[Any, str],
+                                previous_state: Dict[str, Dict], run_fingerprint: str,
+                                state_path: Path, save_queue: int = 0) -> int:
+        """依模板產生部門報表及主報表並記錄增量執行狀態，回傳重建的部門數"""
+        employee_template_path = self.template_dir / self.EMPLOYEE_TEMPLATE_FILE
+        master_template_path = self.template_dir / self.MASTER_TEMPLATE_FILE
         master_output_path = output_folder / "Master_Report.xlsx"
 
-        # 複製模板
-        shutil.copy(master_template_path, master_output_path)
-        wb_master = load_workbook(master_output_path)
+        # 按部門分組處理，各部門回傳其員工的月度統計；未變動的部門直接沿用上次結果
+        dept_results = {}
+        dept_tasks = []
+        for dept_name, dept_group in self.attendance_df.groupby('Company / Department'):
+            dept_fingerprints = {
+                emp_id: fingerprints[emp_id] for emp_id in dept_group['Employee ID'].unique()
+            }
+            previous_dept = previous_state.get(dept_name)
+            cached_counters = self._reusable_counters(
+                previous_dept, dept_fingerprints,
+                self._dept_output_path(output_folder, current_month, dept_name)
+            )
+            # 員工及指紋皆與上次相同 (無新增、移除或變動) 才可整個部門略過
+            if (cached_counters is not None and
+                    len(cached_counters) == len(previous_dept) == len(dept_fingerprints)):
+                self.logger.info(f"⏭️ Dept unchanged: {dept_name}")
+                dept_results[dept_name] = list(cached_counters.items())
+                continue
+
+            dept_results[dept_name] = None
+            dept_tasks.append((dept_name, dept_group, current_month, employee_template_path,
+                               output_folder, streaming, cached_counters))
+
+        for task, (dept_rows, dept_timing) in zip(dept_tasks, self._run_departments(dept_tasks, workers, save_queue)):
+            dept_results[task[0]] = dept_rows
+            self.department_timings[task[0]] = dept_timing
+            self.timer.merge(dept_timing['stages'])
+
+        # 由模板原型建立主報表，依部門及員工順序寫入 (部門報表皆已存檔完成)
+        with self.timer.measure('master.open'):
+            wb_master = self._template_prototype(master_template_path).new_workbook()
+            self._init_master_report(wb_master)
+
+        with self.timer.measure('master.write'):
+            for dept_rows in dept_results.values():
+                for emp_id, monthly_counters in dept_rows:
+                    self._generate_master_report(emp_id, monthly_counters)
+
+        with self.timer.measure('master.save'):
+            wb_master.save(master_output_path)
+
+        # 部門及公司彙總直接由各員工月度統計 (含沿用上次結果者) 加總，不需重讀報表或重新計算每日指標
+        with self.timer.measure('rollup.build'):
+            counter_store = self._counter_store(
+                (dept_name, emp_id, monthly_counters)
+                for dept_name, dept_rows in dept_results.items()
+                for emp_id, monthly_counters in dept_rows
+            )
+            rollups = self._rollup_tables(counter_store)
+        with self.timer.measure('rollup.save'):
+            self._write_data_workbook(output_folder / self.ROLLUP_REPORT_FILE, rollups)
+
+        # 記錄本次各員工指紋與月度統計，供下次增量執行比對
+        self._write_pickle(state_path, {
+            'version': self.RUN_STATE_VERSION,
+            'run': run_fingerprint,
+            'departments': {
+                dept_name: {emp_id: (fingerprints[emp_id], monthly_counters)
+                            for emp_id, monthly_counters in dept_rows}
+                for dept_name, dept_rows in dept_results.items()
+            }
+        })
+        return len(dept_tasks)
+
+    def _export_data_tables(self, output_folder: Path, formats: list):
+        """不經模板輸出資料表：每日明細 (Daily_Detail)、主報表數據 (Master_Report) 及部門/公司彙總"""
+        with self.timer.measure('export.prepare'):
+            totals = self._monthly_totals(self.attendance_df, ['Company / Department', 'Employee ID'])
+            counter_store = self._counter_store(
+                (dept_name, emp_id, monthly_counters)
+                for (dept_name, emp_id), monthly_counters in totals.to_dict('index').items()
+            )
+            tables = {'Master_Report': self._master_table(counter_store), 'Daily_Detail': self._detail_table(),
+                      **self._rollup_tables(counter_store)}
+
+        for fmt in formats:
+            with self.timer.measure(f'export.{fmt}'):
+                if fmt == 'xlsx-data':
+                    paths = [output_folder / "Attendance_Data.xlsx"]
+                    self._write_data_workbook(paths[0], tables)
+                else:
+                    paths = [output_folder / f"{name}{self.EXPORT_FORMATS[fmt]}" for name in tables]
+                    for path, frame in zip(paths, tables.values()):
+                        self._write_table(frame, path)
+            self.logger.info(f"📤 {fmt}: {', '.join(path.name for path in paths)}")
+
+    def _counter_store(self, records) -> pd.DataFrame:
+        """將各員工月度統計整理為欄式資料表：每名員工一列，各月度統計器一欄
+
+        records 為 (Company / Department, Employee ID, 月度統計) 的序列，未提供的統計器為 0。
+        """
+        counter_names = list(self._init_monthly_counters())
+        return pd.DataFrame.from_records(
+            [(dept_name, emp_id, *(monthly_counters.get(name, 0) for name in counter_names))
+             for dept_name, emp_id, monthly_counters in records],
+            columns=['Company / Department', 'Employee ID', *counter_names]
+        )
+
+    def _rollup_tables(self, counter_store: pd.DataFrame) -> Dict[str, pd.DataFrame]:
+        """由月度統計欄式資料表加總部門及公司統計，回傳 {Department_Summary, Company_Summary}
+
+        公司取 Company / Department 中 '/' 之前的部分，公司彙總最後一列 TOTAL 為全體合計。
+        與主報表相同，不在 Employee 工作表的員工不計入，人數及合計與主報表一致。
+        """
+        counter_store = counter_store[counter_store['Employee ID'].isin(self.employee_index)]
+        # 與主報表相同：手動加班分鐘逐人轉為小時後計入 FINAL OT 1.5
+        manual_ot = (counter_store['MANUAL_OT'] / 60).round(2)
+        stats = counter_store.assign(**{
+            'MANUAL_OT': manual_ot,
+            'FINAL_OT1.5': counter_store['OT1.5'] + manual_ot,
+            'Company': counter_store['Company / Department'].astype(str).str.split('/', n=1).str[0].str.strip(),
+        })
+
+        def summarize(frame: pd.DataFrame, keys: list) -> pd.DataFrame:
+            grouped = frame.groupby(keys)
+            table = grouped[list(self.ROLLUP_HEADERS)].sum().round(2)
+            table.insert(0, 'Employees', grouped['Employee ID'].nunique())
+            return table.reset_index().rename(columns=self.ROLLUP_HEADERS)
 
-        # 樣式設定
-        yellow_fill = PatternFill(start_color="FFFF00", end_color="FFFF00", fill_type="solid")
-        pink_fill = PatternFill(start_color="FFC0CB", end_color="FFC0CB", fill_type="solid")
+        return {
+            'Department_Summary': summarize(stats, ['Company', 'Company / Department']),
+            'Company_Summary': pd.concat([summarize(stats, ['Company']),
+                                          summarize(stats.assign(Company='TOTAL'), ['Company'])],
+                                         ignore_index=True),
+        }
 
-        # 按部門分組處理
-        dept_grouped = self.attendance_df.groupby('Company / Department')
+    def _master_table(self, counter_store: pd.DataFrame) -> pd.DataFrame:
+        """主報表數據，依部門及員工順序 (counter_store 的列順序)，欄位與主報表模板標題相同"""
+        counter_names = list(self._init_monthly_counters())
+        rows = []
+        for emp_id, *counters in counter_store[['Employee ID', *counter_names]].itertuples(index=False, name=None):
+            values = self._master_values(emp_id, dict(zip(counter_names, counters)))
+            if values is None:
+                continue
+            emp_info, monthly_counters = values
+            rows.append([emp_info.get(field, '') for field in self.MASTER_INFO_HEADERS] +
+                        [monthly_counters.get(field, 0) for field in self.MASTER_STAT_HEADERS])
+        return pd.DataFrame(rows, columns=[*self.MASTER_INFO_HEADERS.values(), *self.MASTER_STAT_HEADERS.values()])
+
+    def _detail_table(self) -> pd.DataFrame:
+        """每日明細 (依 Employee ID、Date 排序)，打卡時間轉為 HH:MM:SS 文字"""
+        detail_df = self.attendance_df[self.DETAIL_COLUMNS].copy()
+        for column in ['Clock-in', 'Clock-out']:
+            seconds = self.attendance_df[column]
+            clock = pd.to_datetime(seconds.fillna(0).astype('int64'), unit='s').dt.strftime('%H:%M:%S')
+            detail_df[column] = clock.where(seconds.notna(), None)
+        return detail_df
+
+    @staticmethod
+    def _write_table(frame: pd.DataFrame, path: Path):
+        """寫出單一資料表 (CSV 或 Parquet，Parquet 需安裝 pyarrow)"""
+        if path.suffix == '.parquet':
+            try:
+                frame.to_parquet(path, index=False)
+            except ImportError:
+                raise ImportError("Parquet export requires pyarrow (pip install pyarrow)") from None
+        else:
+            frame.to_csv(path, index=False, encoding='utf-8-sig')
 
-        for dept_name, dept_group in dept_grouped:
-            self._process_department(
-                dept_name, dept_group, current_month,
-                employee_template_path, output_folder,
-                wb_master, yellow_fill, pink_fill
-            )
+    @staticmethod
+    def _write_data_workbook(path: Path, tables: Dict[str, pd.DataFrame]):
+        """寫出不含模板格式的 xlsx，每個資料表一個工作表"""
+        try:
+            import xlsxwriter  # noqa: F401
+        except ImportError:
+            # 未安裝 xlsxwriter 時以 openpyxl write-only 逐列串流寫出
+            from openpyxl import Workbook
+            wb = Workbook(write_only=True)
+            for name, frame in tables.items():
+                sheet = wb.create_sheet(name)
+                sheet.append(list(frame.columns))
+                for row in frame.astype(object).where(frame.notna(), None).itertuples(index=False):
+                    sheet.append(row)
+            wb.save(path)
+        else:
+            with pd.ExcelWriter(path, engine='xlsxwriter') as writer:
+                for name, frame in tables.items():
+                    frame.to_excel(writer, sheet_name=name, index=False)
+
+    def process_batch(self, input_files: list, use_cache: bool = True, workers: int = 1,
+                      streaming: bool = False, incremental: bool = False,
+                      month: Optional[str] = None, export_formats: Optional[list] = None,
+                      save_queue: Optional[int] = None) -> list:
+        """批次處理多個 masterdata (多月份、多廠區)，回傳已處理的 (月份, 廠區, 輸出資料夾)
+
+        考勤資料依 Date 所屬月份分割，報表輸出至 <output>/<YYYY-MM>/<廠區>/；
+        班別規則及模板原型在整個批次中共用。month 可為 YYYY-MM 或月份名稱，只處理該月份。
+        """
+        output_root = self.output_dir
+        processed = []
+        try:
+            for input_file, site in zip(input_files, self._site_names(input_files)):
+                self.input_file = Path(input_file).absolute()
+                self._load_data(use_cache=use_cache)
+
+                site_attendance = self.attendance_df
+                periods = pd.to_datetime(site_attendance['Date'], errors='coerce').dt.to_period('M')
+                if periods.isna().any():
+                    self.logger.warning(f"⚠️ {site}: {int(periods.isna().sum())} attendance rows "
+                                        f"without a valid Date are skipped")
+
+                for period, month_df in site_attendance.groupby(periods, sort=True):
+                    if month and month not in (str(period), period.strftime('%B')):
+                        continue
+                    self.logger.info(f"📅 {site} {period}: {len(month_df)} attendance rows")
+                    self.attendance_df = month_df.reset_index(drop=True)
+                    self.month = period.strftime('%B')
+                    self.output_dir = output_root / str(period) / site
+                    self.run_label = f"{period}_{site}"
+                    self._process_attendance_data(workers=workers, streaming=streaming,
+                                                  incremental=incremental, export_formats=export_formats,
+                                                  save_queue=save_queue)
+                    processed.append((str(period), site, self.output_dir))
+                    # 耗時依月份及廠區分別記錄
+                    self.timer = StageTimer()
+                    self.department_timings = {}
+        finally:
+            self.output_dir = output_root
+            self.run_label = None
+
+        if not processed:
+            self.logger.warning("⚠️ 批次中沒有可處理的考勤資料")
+        return processed
+
+    @staticmethod
+    def _site_names(input_files: list) -> list:
+        """廠區名稱取自檔名；檔名重複時 (如各廠區資料夾內皆為 masterdata.xlsx) 改用所在資料夾名稱"""
+        stems = [Path(path).stem for path in input_files]
+        names = [Path(path).parent.name if stems.count(stem) > 1 else stem
+                 for path, stem in zip(input_files, stems)]
+        duplicates = sorted({name for name in names if names.count(name) > 1})
+        if duplicates:
+            raise ValueError(f"Duplicate site names in batch: {', '.join(duplicates)}")
+        return names
+
+    def process_archive(self, archive_files: list, use_cache: bool = True,
+                        chunk_rows: Optional[int] = None, month: Optional[str] = None) -> list:
+        """分批處理多年度考勤封存檔 (CSV / Parquet)，回傳各月份主報表路徑
+
+        員工、請假、假期、午餐及手動加班資料仍由 masterdata 讀取；考勤資料每批最多 chunk_rows 列，
+        逐批套用與一般流程相同的每日指標，依 (月份, 部門, 員工) 累加月度統計後即丟棄明細，
+        記憶體用量與封存檔大小無關。最後每個月份以主報表模板輸出 <output>/archive/<YYYY-MM>_Master_Report.xlsx；
+        month 可為 YYYY-MM 或月份名稱，只處理該月份。
+        """
+        start = perf_counter()
+        chunk_rows = chunk_rows or self.ARCHIVE_CHUNK_ROWS
+        self._load_data(use_cache=use_cache)
+
+        keys = ['PERIOD', 'Company / Department', 'Employee ID']
+        totals = None
+        total_rows = 0
+        for archive_file in archive_files:
+            self.logger.info(f"📁 分批讀取 {Path(archive_file).name} (每批 {chunk_rows} 列)...")
+            chunks = self._iter_archive_chunks(Path(archive_file), chunk_rows)
+            while True:
+                with self.timer.measure('archive.read'):
+                    chunk = next(chunks, None)
+                if chunk is None:
+                    break
+                with self.timer.measure('archive.prepare'):
+                    chunk = self._prepare_archive_chunk(chunk, month)
+                if chunk.empty:
+                    continue
+
+                self.attendance_df = chunk
+                self._calc_daily_metrics()
+                daily_df = self.attendance_df
+
+                # 各批的部分加總併入累計結果，明細不保留
+                with self.timer.measure('archive.merge'):
+                    daily_df['PERIOD'] = daily_df['Date'].dt.to_period('M')
+                    partial = self._monthly_totals(daily_df, keys)
+                    totals = partial if totals is None else (
+                        pd.concat([totals, partial]).groupby(level=keys).sum())
+                total_rows += len(chunk)
+                self.logger.info(f"📊 已處理 {total_rows} 筆考勤資料")
+
+        output_paths = []
+        if totals is None:
+            self.logger.warning("⚠️ 封存檔中沒有可處理的考勤資料")
+        else:
+            totals = totals.sort_index()
+            for period, period_totals in totals.groupby(level='PERIOD', sort=True):
+                output_paths.append(self._write_archive_summary(str(period), period_totals))
 
-        wb_master.save(master_output_path)
+        self.run_label = 'archive'
+        try:
+            self._write_timing_summary(perf_counter() - start, attendance_rows=total_rows,
+                                       chunk_rows=chunk_rows, months=len(output_paths))
+        finally:
+            self.run_label = None
+        return output_paths
+
+    def _iter_archive_chunks(self, archive_path: Path, chunk_rows: int):
+        """逐批讀取考勤封存檔 (Parquet 需安裝 pyarrow)"""
+        if archive_path.suffix.lower() == '.parquet':
+            try:
+                import pyarrow.parquet as pq
+            except ImportError:
+                raise ImportError("Reading Parquet archives requires pyarrow (pip install pyarrow)") from None
+            for batch in pq.ParquetFile(archive_path).iter_batches(batch_size=chunk_rows):
+                yield batch.to_pandas()
+        else:
+            yield from pd.read_csv(archive_path, chunksize=chunk_rows, dtype=self.MASTERDATA_DTYPES)
+
+    def _prepare_archive_chunk(self, chunk: pd.DataFrame, month: Optional[str] = None) -> pd.DataFrame:
+        """封存檔每批資料轉為與 masterdata 考勤表相同的格式 (指定 month 時只保留該月份)"""
+        chunk['Date'] = pd.to_datetime(chunk['Date'], errors='coerce')
+        invalid = chunk['Date'].isna()
+        if invalid.any():
+            self.logger.warning(f"⚠️ {int(invalid.sum())} attendance rows without a valid Date are skipped")
+        keep = ~invalid
+        if month:
+            keep &= ((chunk['Date'].dt.strftime('%Y-%m') == month) |
+                     (chunk['Date'].dt.strftime('%B') == month))
+        chunk = chunk[keep].reset_index(drop=True)
+
+        for column in ['Clock-in', 'Clock-out']:
+            # Parquet 可能存為 time 物件，統一轉成文字後解析
+            chunk[column] = self._parse_clock(chunk[column].astype('string'))
+        return chunk
+
+    def _write_archive_summary(self, period: str, period_totals: pd.DataFrame) -> Path:
+        """以主報表模板輸出單一月份的統計 (依部門、員工順序)"""
+        output_folder = self.output_dir / 'archive'
+        output_folder.mkdir(parents=True, exist_ok=True)
+        output_path = output_folder / f"{period}_Master_Report.xlsx"
+
+        with self.timer.measure('master.open'):
+            prototype = self._template_prototype(self.template_dir / self.MASTER_TEMPLATE_FILE)
+            wb_master = prototype.new_workbook()
+            self._init_master_report(wb_master)
+
+        with self.timer.measure('master.write'):
+            for (_, _, emp_id), monthly_counters in period_totals.to_dict('index').items():
+                self._generate_master_report(emp_id, monthly_counters)
+
+        with self.timer.measure('master.save'):
+            wb_master.save(output_path)
+        self.logger.info(f"📄 {period}: {len(period_totals)} 筆員工統計已寫入 {output_path.name}")
+        return output_path
+
+    def _write_timing_summary(self, process_seconds: float, **run_info) -> Path:
+        """將整體及各部門的階段耗時寫成 JSON，與日誌檔放在同一資料夾"""
+        label = f"_{self.run_label}" if self.run_label else ''
+        summary_path = self.log_file.with_name(f"{self.log_file.stem}{label}_timing.json")
+        stages = self.timer.summary()
+        summary = {
+            'log_file': self.log_file.name,
+            'process_seconds': round(process_seconds, 4),
+            **run_info,
+            'stages': stages,
+            'departments': self.department_timings,
+        }
+        with open(summary_path, 'w', encoding='utf-8') as f:
+            json.dump(summary, f, indent=2, ensure_ascii=False)
+
+        slowest = sorted(stages.items(), key=lambda item: item[1]['seconds'], reverse=True)[:5]
+        self.logger.info("⏱️ 最耗時階段: " + ", ".join(
+            f"{stage} {item['seconds']:.2f}s" for stage, item in slowest))
+        self.logger.info(f"⏱️ 耗時摘要已寫入: {summary_path.name}")
+        return summary_path
+
+    def _write_profile(self, profiler: cProfile.Profile) -> Path:
+        """輸出 cProfile 結果 (.prof 供 snakeviz 等工具開啟，另附依累計時間排序的文字摘要)"""
+        profile_path = self.log_file.with_suffix('.prof')
+        profiler.dump_stats(str(profile_path))
+
+        text_path = self.log_file.with_name(f"{self.log_file.stem}_profile.txt")
+        with open(text_path, 'w', encoding='utf-8') as f:
+            pstats.Stats(profiler, stream=f).sort_stats('cumulative').print_stats(60)
+        self.logger.info(f"🔬 效能分析結果已寫入: {profile_path.name}, {text_path.name}")
+        return profile_path
+
+    def _run_departments(self, dept_tasks: list, workers: int, save_queue: int = 0) -> list:
+        """執行各部門報表，回傳各部門的 ([(Employee ID, 月度統計)], 部門耗時)，順序與 dept_tasks 相同
+
+        循序處理且 save_queue > 0 時，部門活頁簿交由背景執行緒存檔 (最多 save_queue 本等待中)，
+        主執行緒同時計算下一個部門；回傳前等待所有存檔完成，有失敗時拋出 OSError。
+        """
+        workers = min(workers, len(dept_tasks))
+
+        if workers <= 1:
+            if not save_queue:
+                return [self._process_department(*task) for task in dept_tasks]
+
+            self._saver = BackgroundSaver(save_queue, self.logger)
+            try:
+                results = [self._process_department(*task) for task in dept_tasks]
+            finally:
+                saver, self._saver = self._saver, None
+                errors = saver.wait()
+                self.timer.merge(saver.timer.summary())
+            if errors:
+                raise OSError(f"{len(errors)} department workbook(s) failed to save, see log for details")
+            return results
+
+        self.logger.info(f"⚙️ Processing {len(dept_tasks)} depts with {workers} workers")
+        with ProcessPoolExecutor(max_workers=workers,
+                                 initializer=_init_department_worker,
+                                 initargs=(self,)) as executor:
+            # map 依提交順序回傳結果，主報表列順序與循序處理相同
+            return list(executor.map(_process_department_worker, dept_tasks))
+
+    def _run_fingerprint(self, current_month: str, employee_template_path: Path) -> str:
+        """影響所有員工的輸入指紋 (月份、模板、班別規則及一般假期)，變動時需全部重建"""
+        digest = hashlib.sha256()
+        digest.update(current_month.encode('utf-8'))
+        digest.update(self._file_digest(employee_template_path).encode('ascii'))
+        digest.update(repr(self.shift_rules).encode('utf-8'))
+        general_holidays = self.holiday_df[self.holiday_df['Employee ID'].isna()]
+        digest.update(pd.util.hash_pandas_object(general_holidays, index=False).to_numpy().tobytes())
+        return digest.hexdigest()
+
+    def _employee_fingerprints(self) -> Dict[Any, str]:
+        """依員工計算輸入資料指紋 (考勤、請假、午餐、手動加班、個人假期及員工資料)"""
+        tables = [
+            self.attendance_df, self.leave_df, self.meal_df, self.manualot_df,
+            self.holiday_df[self.holiday_df['Employee ID'].notna()], self.employee_df
+        ]
+        # 每張表先逐列雜湊，再依員工串接該員工各列的雜湊值
+        table_hashes = [
+            (pd.util.hash_pandas_object(table, index=False).to_numpy(),
+             table.groupby('Employee ID', sort=False).indices)
+            for table in tables
+        ]
 
-    def _process_department(self, dept_name: str, dept_group: pd.DataFrame,
-                            current_month: str, employee_template_path: Path,
-                            output_folder: Path, wb_master, yellow_fill, pink_fill):
-        """處理部門資料"""
-        self.logger.info(f"🏢 Processing dept: {dept_name}")
+        fingerprints = {}
+        for emp_id in self.attendance_df['Employee ID'].unique():
+            digest = hashlib.sha256()
+            for row_hashes, positions in table_hashes:
+                rows = positions.get(emp_id)
+                if rows is not None:
+                    digest.update(row_hashes[rows].tobytes())
+                digest.update(b'|')
+            fingerprints[emp_id] = digest.hexdigest()
+        return fingerprints
+
+    def _load_run_state(self, state_path: Path, run_fingerprint: str) -> Dict[str, Dict]:
+        """讀取上次執行狀態，月份、模板或規則變動時視為無狀態"""
+        state = self._read_pickle(state_path, self.RUN_STATE_VERSION)
+        if state is None or state['run'] != run_fingerprint:
+            self.logger.info("🔄 無可用的上次執行狀態，重新產生所有報表")
+            return {}
+        return state['departments']
+
+    @staticmethod
+    def _reusable_counters(previous_dept: Optional[Dict[Any, tuple]],
+                           dept_fingerprints: Dict[Any, str],
+                           dept_output_path: Path) -> Optional[Dict[Any, Dict]]:
+        """找出部門內指紋未變動、可沿用上次月度統計的員工；無上次報表時回傳 None"""
+        if previous_dept is None or not dept_output_path.exists():
+            return None
+        return {
+            emp_id: monthly_counters
+            for emp_id, (fingerprint, monthly_counters) in previous_dept.items()
+            if dept_fingerprints.get(emp_id) == fingerprint
+        }
 
+    @staticmethod
+    def _dept_output_path(output_folder: Path, current_month: str, dept_name: str) -> Path:
+        """部門報表輸出路徑"""
         safe_dept_name = dept_name.replace('/', '_').replace('\\', '_')
-        dept_output_path = output_folder / f"{current_month}_{safe_dept_name}_Report.xlsx"
+        return output_folder / f"{current_month}_{safe_dept_name}_Report.xlsx"
+
+    @staticmethod
+    def _sheet_title(emp_id) -> str:
+        """員工工作表名稱 (Excel 限制最多31字元)"""
+        return str(emp_id)[:31]
+
+    def _calc_daily_metrics(self):
+        """整批計算所有每日指標欄位，結果依 Employee ID、Date 排序；部門及員工報表直接切片使用"""
+        self.attendance_df = (self.attendance_df.sort_values(by=['Employee ID', 'Date'], kind='stable')
+                              .reset_index(drop=True))
+
+        # 班別及星期的規則索引只計算一次，之後各指標直接查表
+        with self.timer.measure('daily.RULE INDEX'):
+            self.attendance_df[self.RULE_INDEX_COLUMNS] = np.column_stack(
+                self._shift_rule_index(self.attendance_df))
+
+        # 工作日類型為後續各項指標的判斷依據，需最先計算
+        with self.timer.measure('daily.DAY TYPE'):
+            self.attendance_df['DAY TYPE'] = self.auto_day_type(self.attendance_df)
+        with self.timer.measure('daily.WORK'):
+            self.attendance_df['WORK'] = self.calc_work_hours(self.attendance_df)
+
+        with self.timer.measure('daily.OT'):
+            ot = self.calc_ot(self.attendance_df)
+            self.attendance_df[ot.columns] = ot
+
+        with self.timer.measure('daily.LEAVE'):
+            leave = self.map_leave(self.attendance_df)
+            self.attendance_df[leave.columns] = leave
+
+        with self.timer.measure('daily.MEAL RECORD'):
+            meal_record = self._lookup_daily_records(self.attendance_df, self.meal_df, [])
+            self.attendance_df['MEAL RECORD'] = (meal_record['_merge'] == 'both').to_numpy()
+        with self.timer.measure('daily.MANUAL OT'):
+            self.attendance_df['MANUAL OT'] = self.map_manual_ot(self.attendance_df)
+
+        # 遲到、早退、忘記打卡、缺勤需在工作日類型及請假之後計算
+        column_metrics = [
+            ('LATE_MIN', self.calc_late),
+            ('EARLY_MIN', self.calc_early),
+            ('FORGOT_CLOCKING', self._calc_forgot_clocking),
+            ('ABSENT', self._calc_absent),
+            ('DEPARTMENT', self.map_dept),
+            ('SHIFT', self.map_shift),
+            ('MEAL', self.map_meal),
+        ]
+        for column, func in column_metrics:
+            with self.timer.measure(f'daily.{column}'):
+                self.attendance_df[column] = func(self.attendance_df)
+
+    def _process_department(self, dept_name: str, *args, **kwargs) -> tuple:
+        """處理部門資料並量測耗時，回傳 ([(Employee ID, 月度統計)], 部門耗時摘要)"""
+        run_timer, self.timer = self.timer, StageTimer()
+        start = perf_counter()
+        try:
+            master_rows = self._build_department_report(dept_name, *args, **kwargs)
+        finally:
+            dept_timer, self.timer = self.timer, run_timer
+
+        dept_timing = {
+            'seconds': round(perf_counter() - start, 4),
+            'employees': len(master_rows),
+            'stages': dept_timer.summary()
+        }
+        return master_rows, dept_timing
 
-        shutil.copy(employee_template_path, dept_output_path)
-        wb_dept = load_workbook(dept_output_path)
+    def _build_department_report(self, dept_name: str, dept_group: pd.DataFrame,
+                                 current_month: str, employee_template_path: Path,
+                                 output_folder: Path, streaming: bool = False,
+                                 cached_counters: Optional[Dict[Any, Dict]] = None) -> list:
+        """建立部門報表，回傳部門內各員工的 (Employee ID, 月度統計)
 
-        emp_grouped = dept_group.groupby('Employee ID')
+        提供 cached_counters 時為增量更新：開啟既有部門報表，沿用其中員工的工作表與月度統計，
+        只重建其餘員工的工作表。
+        """
+        from openpyxl import load_workbook
 
-        for emp_id, group in emp_grouped:
-            self._process_employee(
-                emp_id, group, wb_dept, wb_master, yellow_fill, pink_fill
+        self.logger.info(f"🏢 Processing dept: {dept_name}")
+
+        dept_output_path = self._dept_output_path(output_folder, current_month, dept_name)
+        emp_ids = dept_group['Employee ID'].drop_duplicates().sort_values().tolist()
+
+        with self.timer.measure('workbook.open'):
+            if cached_counters is not None:
+                self.logger.info(f"🔁 Updating {len(emp_ids) - len(cached_counters)} of "
+                                 f"{len(emp_ids)} employees in {dept_name}")
+                prototype = None
+                wb_dept = load_workbook(dept_output_path)
+                kept_titles = {self._sheet_title(emp_id) for emp_id in cached_counters}
+                for title in wb_dept.sheetnames:
+                    if title not in kept_titles:
+                        wb_dept.remove(wb_dept[title])
+                # 既有報表已無模板頁，重新放入供 copy_worksheet 使用
+                self._template_prototype(employee_template_path).copy_to(wb_dept.create_sheet('Sheet1'))
+            elif streaming:
+                # 串流模式：只保留模板原型，員工工作表依序寫出，不在記憶體保留整本活頁簿
+                prototype = self._template_prototype(employee_template_path)
+                wb_dept = prototype.new_workbook(write_only=True)
+            else:
+                prototype = None
+                wb_dept = self._template_prototype(employee_template_path).new_workbook()
+
+        # 每日指標已整批算好 (依 Employee ID、Date 排序)，整個部門一次計算週/月統計，增量更新時只計算需重建的員工
+        pending = dept_group
+        if cached_counters is not None:
+            pending = dept_group[~dept_group['Employee ID'].isin(list(cached_counters))]
+        if not pending.empty:
+            with self.timer.measure('employee.aggregate'):
+                report_rows, monthly_totals = self._aggregate_reports(pending.reset_index(drop=True))
+
+        master_rows = []
+        # 同一活頁簿內相同樣式的儲存格共用一份樣式陣列
+        style_pool = {}
+
+        for emp_id in emp_ids:
+            if cached_counters is not None and emp_id in cached_counters:
+                master_rows.append((emp_id, cached_counters[emp_id]))
+                continue
+
+            monthly_counters = self._init_monthly_counters()
+            monthly_counters.update(monthly_totals[emp_id])
+            self._generate_employee_report(
+                emp_id, monthly_counters, report_rows.employee(emp_id),
+                wb_dept, prototype, style_pool
             )
+            master_rows.append((emp_id, monthly_counters))
 
         # 刪除模板頁
         if "Sheet1" in wb_dept.sheetnames and len(wb_dept.sheetnames) > 1:
             wb_dept.remove(wb_dept["Sheet1"])
 
-        wb_dept.save(dept_output_path)
-
-    def _process_employee(self, emp_id: str, group: pd.DataFrame,
-                          wb_dept, wb_master, yellow_fill, pink_fill):
-        """處理員工資料"""
-        group = group.sort_values(by='Date').reset_index(drop=True)
-
-        # 重置月度統計器
-        self.monthly_counters = self._init_monthly_counters()
-
-        # 計算各項指標
-        group['DAY TYPE'] = group.apply(self.auto_day_type, axis=1)
-        group['WORK'] = group.apply(self.calc_work_hours, axis=1)
-        group['OT'] = group.apply(self.calc_ot, axis=1)
-        group['LATE_MIN'] = group.apply(self.calc_late, axis=1)
-        group['EARLY_MIN'] = group.apply(self.calc_early, axis=1)
-        group['LEAVE'] = group.apply(self.map_leave, axis=1)
-        group['LVE DAYS'] = group.apply(self.map_lve_days, axis=1)
-        group['FORGOT_CLOCKING'] = group.apply(self._calc_forgot_clocking, axis=1)
-        group['ABSENT'] = group.apply(self._calc_absent, axis=1)
-        group['DEPARTMENT'] = group.apply(self.map_dept, axis=1)
-        group['SHIFT'] = group.apply(self.map_shift, axis=1)
-        group['MEAL'] = group.apply(self.map_meal, axis=1)
-        group['MANUAL OT'] = group.apply(self.map_manual_ot, axis=1)
-
-        # 生成報表
-        self._generate_employee_report(emp_id, group, wb_dept, yellow_fill, pink_fill)
-        self._generate_master_report(emp_id, group, wb_master)
-
-    def _calc_forgot_clocking(self, row: Series) -> int:
-        """計算忘記打卡"""
-        return 1 if (row['DAY TYPE'] == "WORK" and
-                     (pd.isna(row['Clock-in']) or pd.isna(row['Clock-out'])) and
-                     not (pd.isna(row['Clock-in']) and pd.isna(row['Clock-out'])) and
-                     row['Day'] not in ['Sat.', 'Sun.']) else 0
-
-    def _calc_absent(self, row: Series) -> int:
-        """計算缺勤"""
-        return 1 if (row['DAY TYPE'] == "WORK" and
-                     pd.isna(row['Clock-in']) and pd.isna(row['Clock-out']) and
-                     row['LEAVE'] == '-') else 0
-
-    def _generate_employee_report(self, emp_id: str, group: pd.DataFrame,
-                                  wb_dept, yellow_fill, pink_fill):
-        """生成員工報表"""
-        # 統計月度數據
-        for idx, row in group.iterrows():
-            self.monthly_counters['LATE_IN'] += 0 if row['LATE_MIN'] == '-' else row['LATE_MIN']
-            self.monthly_counters['EARLY_OUT'] += 0 if row['EARLY_MIN'] == '-' else row['EARLY_MIN']
-            self.monthly_counters['FORGOT_CLOCKING'] += row['FORGOT_CLOCKING']
-            self.monthly_counters['ABSENT'] += row['ABSENT']
-            self.monthly_counters['WORK_HOURS'] += row['WORK']
-            self.monthly_counters['OT_HOURS'] += row['OT']
-            self.monthly_counters['LVE DAYS'] += row['LVE DAYS']
-            self.monthly_counters['MANUAL_OT'] += 0 if row['MANUAL OT'] == '-' else row['MANUAL OT']
-
-        # 建立最終行數據，包含週統計
-        final_rows = []
-        weekly_counters = {
-            'LATE_IN': 0, 'EARLY_OUT': 0, 'FORGOT_CLOCKING': 0, 'ABSENT': 0,
-            'WORK_HOURS': 0, 'OT_HOURS': 0, 'LVE DAYS': 0, 'MEAL': 0, 'MANUAL OT': 0
-        }
+        if cached_counters is not None:
+            # 新建的工作表附加在最後，依員工順序重新排列
+            for index, (emp_id, _) in enumerate(master_rows):
+                sheet = wb_dept[self._sheet_title(emp_id)]
+                wb_dept.move_sheet(sheet, offset=index - wb_dept.index(sheet))
 
-        selected_columns = [
-            "Date", "Day", "DAY TYPE", "Clock-in", "Clock-out", "SHIFT",
-            "LATE_MIN", "EARLY_MIN", "FORGOT_CLOCKING", "ABSENT", "WORK",
-            "LEAVE", "LVE DAYS", "MEAL", "OT", 'MANUAL OT'
-        ]
-
-        for idx, row in group.iterrows():
-            # 添加日常記錄
-            filtered_row = {col: row[col] for col in selected_columns if col in row}
-            filtered_row['Date'] = row['Date'].strftime('%Y-%m-%d')
-            final_rows.append(filtered_row)
-
-            # 累計週統計
-            weekly_counters['LATE_IN'] += 0 if row['LATE_MIN'] == '-' else row['LATE_MIN']
-            weekly_counters['EARLY_OUT'] += 0 if row['EARLY_MIN'] == '-' else row['EARLY_MIN']
-            weekly_counters['FORGOT_CLOCKING'] += row['FORGOT_CLOCKING']
-            weekly_counters['ABSENT'] += row['ABSENT']
-            weekly_counters['WORK_HOURS'] += row['WORK']
-            weekly_counters['OT_HOURS'] += row['OT']
-            weekly_counters['LVE DAYS'] += row['LVE DAYS']
-            weekly_counters['MEAL'] += row['MEAL']
-            weekly_counters['MANUAL OT'] += 0 if row['MANUAL OT'] == '-' else row['MANUAL OT']
-
-            # 如果是週日或最後一筆記錄，插入週統計
-            if row['Day'] == "Sun." or idx == len(group) - 1:
-                week_summary_row = {
-                    'Date': '',
-                    'Day': f"Summary up to {row['Date'].strftime('%Y-%m-%d')}",
-                    'DAY TYPE': '', 'Clock-in': '', 'Clock-out': '', 'SHIFT': '',
-                    'LATE_MIN': weekly_counters['LATE_IN'],
-                    'EARLY_MIN': weekly_counters['EARLY_OUT'],
-                    'FORGOT_CLOCKING': weekly_counters['FORGOT_CLOCKING'],
-                    'ABSENT': weekly_counters['ABSENT'],
-                    'WORK': weekly_counters['WORK_HOURS'],
-                    'LEAVE': '', 'LVE DAYS': weekly_counters['LVE DAYS'],
-                    'MEAL': weekly_counters['MEAL'],
-                    'OT': weekly_counters['OT_HOURS'],
-                    'MANUAL OT': weekly_counters['MANUAL OT']
-                }
-                final_rows.append(pd.Series(week_summary_row))
-
-                # 重置週統計
-                weekly_counters = {
-                    'LATE_IN': 0, 'EARLY_OUT': 0, 'FORGOT_CLOCKING': 0, 'ABSENT': 0,
-                    'WORK_HOURS': 0, 'OT_HOURS': 0, 'LVE DAYS': 0, 'MEAL': 0, 'MANUAL OT': 0
-                }
+        if self._saver is not None:
+            # 背景存檔：佇列已滿時才需等待
+            with self.timer.measure('workbook.save_wait'):
+                self._saver.submit(wb_dept, dept_output_path)
+        else:
+            with self.timer.measure('workbook.save'):
+                wb_dept.save(dept_output_path)
+        return master_rows
+
+    def _template_prototype(self, template_path: Path) -> SheetPrototype:
+        """取得模板原型，同一模板只解析一次 (檔案變更時重新解析)"""
+        stat = template_path.stat()
+        key = (str(template_path), stat.st_mtime_ns, stat.st_size)
+        prototype = self._template_prototypes.get(key)
+        if prototype is None:
+            prototype = self._template_prototypes[key] = SheetPrototype.from_file(template_path)
+        return prototype
+
+    def _aggregate_reports(self, daily_df: pd.DataFrame) -> tuple:
+        """整批計算週統計與月度統計 (daily_df 需依 Employee ID、Date 排序)
+
+        回傳 (ReportRows, 月度統計)：報表列為可直接寫入的明細，每週 (週日或該員工最後一筆) 後插入週統計列；
+        月度統計為 {Employee ID: {統計器名稱: 值}}。
+        """
+        emp_ids = daily_df['Employee ID']
+        is_sunday = (daily_df['Day'] == 'Sun.')
+        # 週次：該列之前已出現的週日數，週日當列仍屬本週
+        week = is_sunday.groupby(emp_ids).cumsum() - is_sunday
+        week_keys = [emp_ids.to_numpy(), week.to_numpy()]
+        positions = np.arange(len(daily_df))
+
+        # 週統計排在該週最後一筆明細之後：先算出每列在報表中的位置，直接填入預先配置的陣列
+        summary_columns = list(self.SUMMARY_COLUMNS)
+        weekly = daily_df[summary_columns].groupby(week_keys, sort=False).sum()
+        closing = pd.Series(positions).groupby(week_keys, sort=False).last().to_numpy()
+        day_at = positions + np.searchsorted(closing, positions, side='left')
+        summary_at = closing + np.arange(len(closing)) + 1
+        columns = {column: index for index, column in enumerate(self.REPORT_COLUMNS)}
+        values = np.full((len(day_at) + len(summary_at), len(columns)), '', dtype=object)
+
+        # 每日明細：空值顯示為 '-'
+        dates = daily_df['Date'].dt.strftime('%Y-%m-%d')
+        for column, index in columns.items():
+            if column == 'Date':
+                cells = dates
+            elif column in ('Clock-in', 'Clock-out'):
+                cells = self._seconds_to_time(daily_df[column])
+            else:
+                cells = daily_df[column].astype(object)
+                if column in self.NULLABLE_COLUMNS:
+                    cells = cells.where(daily_df[column].notna(), '-')
+            values[day_at, index] = cells.to_numpy(dtype=object)
+
+        values[summary_at, columns['Day']] = 'Summary up to ' + dates.to_numpy(dtype=object)[closing]
+        for column in summary_columns:
+            values[summary_at, columns[column]] = weekly[column].astype(object).to_numpy()
+
+        is_summary = np.zeros(len(values), dtype=bool)
+        is_summary[summary_at] = True
+        is_ph = np.zeros(len(values), dtype=bool)
+        is_ph[day_at] = (daily_df['DAY TYPE'] == 'PH').to_numpy()
+
+        # 各員工的列範圍及表頭資料 (取第一筆)
+        emp_values = emp_ids.to_numpy()
+        firsts = np.flatnonzero(np.r_[True, emp_values[1:] != emp_values[:-1]])
+        starts = day_at[firsts]
+        stops = np.r_[starts[1:], len(values)]
+        keys = emp_values[firsts].tolist()
+        spans = dict(zip(keys, zip(starts.tolist(), stops.tolist())))
+        info = dict(zip(keys, daily_df[['Name', 'SHIFT', 'DEPARTMENT']].iloc[firsts]
+                        .itertuples(index=False, name=None)))
+
+        # 月度統計：各欄位依員工加總
+        monthly_totals = self._monthly_totals(daily_df, 'Employee ID', sort=False).to_dict('index')
+
+        return ReportRows(values, is_summary, is_ph, spans, info), monthly_totals
+
+    def _monthly_totals(self, daily_df: pd.DataFrame, keys, sort: bool = True) -> pd.DataFrame:
+        """依 keys 加總月度統計欄位，欄位名稱為月度統計器名稱"""
+        totals = daily_df.groupby(keys, sort=sort)[list(self.MONTHLY_COLUMNS)].sum()
+        totals['CANNOT_OT'] = totals['CANNOT_OT'].astype(int)
+        return totals.rename(columns=self.MONTHLY_COLUMNS)
+
+    def _calc_forgot_clocking(self, attendance_df: pd.DataFrame) -> pd.Series:
+        """計算忘記打卡 (工作日平日只有上班或下班其中一筆打卡)"""
+        clock_in = attendance_df['Clock-in'].isna()
+        clock_out = attendance_df['Clock-out'].isna()
+        return ((attendance_df['DAY TYPE'] == "WORK") & (clock_in ^ clock_out) &
+                ~attendance_df['Day'].isin(['Sat.', 'Sun.'])).astype(int)
+
+    def _calc_absent(self, attendance_df: pd.DataFrame) -> pd.Series:
+        """計算缺勤 (工作日無打卡且未請假)"""
+        return ((attendance_df['DAY TYPE'] == "WORK") &
+                attendance_df['Clock-in'].isna() & attendance_df['Clock-out'].isna() &
+                (attendance_df['LEAVE'] == '-')).astype(int)
+
+    def _generate_employee_report(self, emp_id: str,
+                                  monthly_counters: Dict[str, Union[int, float]],
+                                  employee_rows: tuple,
+                                  wb_dept,
+                                  prototype: Optional[SheetPrototype] = None,
+                                  style_pool: Optional[Dict[tuple, Any]] = None):
+        """生成員工報表 (提供 prototype 時以串流方式寫入 write-only 活頁簿)
+
+        employee_rows 為 ReportRows.employee 回傳的 (報表列, 週統計列偏移, 公共假期列偏移, 員工資料)；
+        style_pool 為同一活頁簿共用的樣式陣列。
+        """
+        # 明細列及需套用格式的列
+        detail_rows, summary_offsets, ph_offsets, (name, shift, department) = employee_rows
 
         # 建立統計表格
         summary_table = [
-            ["LATE IN", "", self.monthly_counters['LATE_IN'], "ABSENT", self.monthly_counters['ABSENT'], "",
-             "OT 1.5HRS", self.monthly_counters['OT1.5']],
-            ["EARLY OUT", "", self.monthly_counters['EARLY_OUT'], "LVE DAYS", self.monthly_counters['LVE DAYS'], "",
-             "OT 2.0HRS", self.monthly_counters['OT2.0']],
-            ["FORGOT CLOCKING", "", self.monthly_counters['FORGOT_CLOCKING'], "MEAL", self.monthly_counters["MEAL"],
-             "", "OT 3.0HRS", self.monthly_counters['OT3.0'], "", "", "", "", "", "", "", "",
-             self.monthly_counters['OT_HOURS']],
+            ["LATE IN", "", monthly_counters['LATE_IN'], "ABSENT", monthly_counters['ABSENT'], "",
+             "OT 1.5HRS", monthly_counters['OT1.5']],
+            ["EARLY OUT", "", monthly_counters['EARLY_OUT'], "LVE DAYS", monthly_counters['LVE DAYS'], "",
+             "OT 2.0HRS", monthly_counters['OT2.0']],
+            ["FORGOT CLOCKING", "", monthly_counters['FORGOT_CLOCKING'], "MEAL", monthly_counters["MEAL"],
+             "", "OT 3.0HRS", monthly_counters['OT3.0'], "", "", "", "", "", "", "", "",
+             monthly_counters['OT_HOURS']],
             ["MANUAL CLOCKING", "", "", "", "", "", "MANUAL OT HRS",
-             round(self.monthly_counters['MANUAL_OT'] / 60, 2)],
+             round(monthly_counters['MANUAL_OT'] / 60, 2)],
             ["", "", "", "", "", "", "CANNOT OT", ""]
         ]
 
         employee_info = [
-            ["NAME", group.iloc[0]['Name'], "", "", "", "", "ID", emp_id, "", "", "SHIFT",
-             group.iloc[0]['SHIFT'], "", "", "", "DEPT", group.iloc[0]['DEPARTMENT']],
+            ["NAME", name, "", "", "", "", "ID", emp_id, "", "", "SHIFT",
+             shift, "", "", "", "DEPT", department],
         ]
 
-        self.logger.info(f"💾 Generate {emp_id}-{group.iloc[0]['Name']} employee report...")
+        self.logger.info(f"💾 Generate {emp_id}-{name} employee report...")
 
         # 寫入Excel
-        final_df = pd.DataFrame(final_rows)
-        source_sheet = wb_dept['Sheet1']
-        new_sheet = wb_dept.copy_worksheet(source_sheet)
-        new_sheet.title = str(emp_id)[:31]  # 限制Sheet名稱最多31字元
-
-        # 寫入統計表格
-        for r_idx, row in enumerate(summary_table, 1):
-            for c_idx, value in enumerate(row, 2):
-                new_sheet.cell(row=r_idx, column=c_idx, value=value)
-
-        # 寫入員工資訊
-        for r_idx, row in enumerate(employee_info, len(summary_table) + 4):
-            for c_idx, value in enumerate(row, 1):
-                new_sheet.cell(row=r_idx, column=c_idx, value=value)
-
-        # 寫入明細資料
-        for r_idx, row in enumerate(dataframe_to_rows(final_df, index=False, header=False),
-                                  start=len(summary_table) + len(employee_info) + 6):
-            for c_idx, value in enumerate(row, 1):
-                new_sheet.cell(row=r_idx, column=c_idx, value=value)
-
-        # 套用格式：週統計行加黃底粗體
-        for row in new_sheet.iter_rows(min_row=1, max_row=new_sheet.max_row):
-            for cell in row:
-                if cell.value and isinstance(cell.value, str) and "Summary up to" in cell.value:
-                    for summary_cell in row:
-                        summary_cell.fill = yellow_fill
-                        summary_cell.font = Font(bold=True, size=16)
-                    break
+        sheet_title = self._sheet_title(emp_id)
+        detail_start_row = len(summary_table) + len(employee_info) + 6
+        blocks = [
+            (1, 2, summary_table),
+            (len(summary_table) + 4, 1, employee_info),
+            (detail_start_row, 1, detail_rows),
+        ]
+        summary_rows = [detail_start_row + offset for offset in summary_offsets]
+        ph_rows = [detail_start_row + offset for offset in ph_offsets]
+
+        if prototype is not None:
+            values = {
+                (r_idx, c_idx): value
+                for start_row, start_col, rows in blocks
+                for r_idx, row in enumerate(rows, start_row)
+                for c_idx, value in enumerate(row, start_col)
+            }
+            row_styles = {row: 'summary' for row in summary_rows}
+            row_styles.update({row: 'ph' for row in ph_rows})
+            with self.timer.measure('sheet.write'):
+                prototype.stream_to(wb_dept.create_sheet(title=sheet_title), values, row_styles,
+                                    self.row_styles())
+            return
 
-        # 公共假期行加粉色底
-        header = [cell.value for cell in new_sheet[11]]
-        if 'DAY TYPE' in header:
-            day_type_col_index = header.index('DAY TYPE') + 1
-            for row in new_sheet.iter_rows(min_row=1, max_row=new_sheet.max_row):
-                work_cell = row[day_type_col_index - 1]
-                if work_cell.value == 'PH':
-                    for cell in row:
-                        cell.fill = pink_fill
+        with self.timer.measure('sheet.write'):
+            source_sheet = wb_dept['Sheet1']
+            new_sheet = wb_dept.copy_worksheet(source_sheet)
+            new_sheet.title = sheet_title
+
+            for start_row, start_col, rows in blocks:
+                self._write_rows(new_sheet, rows, start_row=start_row, start_col=start_col)
+
+        # 套用格式：週統計行加黃底粗體，公共假期行加粉色底
+        with self.timer.measure('sheet.style'):
+            style_pool = {} if style_pool is None else style_pool
+            max_column = new_sheet.max_column
+            named_styles = self.row_styles()
+            row_styles = [(row, 'summary') for row in summary_rows] + [(row, 'ph') for row in ph_rows]
+            for row, kind in row_styles:
+                for col in range(1, max_column + 1):
+                    self._apply_row_style(new_sheet.cell(row=row, column=col), kind, named_styles[kind],
+                                          style_pool)
+
+            # 寫入完成後才共用樣式陣列 (寫入時間值會就地修改數值格式)
+            for cell in new_sheet._cells.values():
+                if cell._style is not None:
+                    cell._style = style_pool.setdefault(tuple(cell._style), cell._style)
+
+    @staticmethod
+    def _apply_row_style(cell, kind: str, styles: Dict[str, Any], style_pool: Dict[tuple, Any]):
+        """套用列格式：同一原樣式加上同一格式只註冊一次，之後共用結果樣式陣列"""
+        key = (kind, tuple(cell._style or ()))
+        cached = style_pool.get(key)
+        if cached is None:
+            for attr, value in styles.items():
+                setattr(cell, attr, value)
+            cached = style_pool[key] = cell._style
+        cell._style = cached
+
+    @staticmethod
+    def _write_rows(sheet, rows: list, start_row: int, start_col: int = 1):
+        """由指定儲存格起整批寫入多列資料"""
+        for r_idx, row in enumerate(rows, start_row):
+            for c_idx, value in enumerate(row, start_col):
+                sheet.cell(row=r_idx, column=c_idx, value=value)
+
+    def _init_master_report(self, wb_master):
+        """開啟主報表時建立欄位對照與寫入游標"""
+        self.master_sheet = wb_master.active
+        header = [cell.value for cell in self.master_sheet[1]]
+
+        # 統計資料及員工基本資料欄位 (1-based)，模板缺少的欄位略過
+        self.master_stat_columns = {
+            field: self.get_col_index(header, name) + 1
+            for field, name in self.MASTER_STAT_HEADERS.items() if name in header
+        }
+        self.master_info_columns = {
+            field: self.get_col_index(header, name) + 1
+            for field, name in self.MASTER_INFO_HEADERS.items() if name in header
+        }
 
+        # 寫入游標：只在開啟時找一次第一個空白列，之後逐列遞增
+        self.master_next_row = self.find_first_empty_row(
+            self.master_sheet, self.master_info_columns.get('Employee ID', 1)
+        )
 
-    def _generate_master_report(self, emp_id: str, group: pd.DataFrame, wb_master):
+    def _generate_master_report(self, emp_id: str, monthly_counters: Dict[str, Union[int, float]]):
         """生成主報表"""
-        # self.logger.info(f"💾 Generate {emp_id}-{group.iloc[0]['Name']} master report...")
-
-        source_sheet_master = wb_master.active
-        header = [cell.value for cell in source_sheet_master[1]]
-
-        # 取得對應欄位索引
-        stat_columns = {
-            'OT1.5': self.get_col_index(header, 'OT 1.5'),
-            'OT2.0': self.get_col_index(header, 'OT 2.0'),
-            'OT3.0': self.get_col_index(header, 'OT 3.0'),
-            'MANUAL_OT': self.get_col_index(header, 'MANUAL OT'),
-            'ABSENT': self.get_col_index(header, 'ABS'),
-            'MEAL': self.get_col_index(header, 'MEAL'),
-            'LVE DAYS': self.get_col_index(header, 'LVE DAYS'),
-            'CANNOT_OT': self.get_col_index(header, 'CANNOT OT'),
-            'LATE_IN': self.get_col_index(header, 'LATE IN'),
-            'EARLY_OUT': self.get_col_index(header, 'EARLY OUT'),
-            'FINAL_OT1.5': self.get_col_index(header, 'FINAL OT 1.5')
-        }
+        values = self._master_values(emp_id, monthly_counters)
+        if values is None:
+            return
+        emp_info, monthly_counters = values
 
-        # 員工基本資料欄位位置
-        basic_info_columns = {
-            'Type': self.get_col_index(header, 'Type'),
-            'Employee ID': self.get_col_index(header, 'Employee ID'),
-            'Name': self.get_col_index(header, 'Name (EN)'),
-            'Department': self.get_col_index(header, 'Department'),
-            'Shift': self.get_col_index(header, 'Shift'),
-            'On board date': self.get_col_index(header, 'On board date'),
-            'Leave date': self.get_col_index(header, 'Leave date[YYMMDD]')
-        }
+        target_row = self.master_next_row
+        self.master_next_row += 1
 
-        # 處理統計資料
-        self.monthly_counters['MANUAL_OT'] = round(self.monthly_counters['MANUAL_OT'] / 60, 2)
-        self.monthly_counters['FINAL_OT1.5'] = self.monthly_counters['OT1.5'] + self.monthly_counters['MANUAL_OT']
+        # 寫入員工基本資料
+        for field, col in self.master_info_columns.items():
+            self.master_sheet.cell(row=target_row, column=col, value=emp_info.get(field, ''))
+
+        # 寫入統計資料
+        for field, col in self.master_stat_columns.items():
+            self.master_sheet.cell(row=target_row, column=col, value=monthly_counters.get(field, 0))
+
+    def _master_values(self, emp_id: str, monthly_counters: Dict[str, Union[int, float]]) -> Optional[tuple]:
+        """主報表單列資料，回傳 (員工資料, 統計資料)；員工不在 Employee 工作表時記錄警告並回傳 None"""
+        # 處理統計資料 (手動加班分鐘轉為小時)
+        monthly_counters = dict(monthly_counters)
+        monthly_counters['MANUAL_OT'] = round(monthly_counters['MANUAL_OT'] / 60, 2)
+        monthly_counters['FINAL_OT1.5'] = monthly_counters['OT1.5'] + monthly_counters['MANUAL_OT']
 
         # 取得員工資訊
-        emp_info_row = self.employee_df[self.employee_df['Employee ID'] == emp_id]
+        emp_info = self.employee_index.get(emp_id)
 
-        if emp_info_row.empty:
+        if emp_info is None:
             self.logger.warning(f"⚠️ EMP ID: {emp_id} missing in masterdata.xlsx --> Employee sheet")
-            return
+            return None
+        return emp_info, monthly_counters
 
-        # 轉換為字典
-        emp_info = emp_info_row.iloc[0].to_dict()
+    def _show_completion_message(self):
+        """顯示完成訊息"""
+        self._show_message('showinfo', "Completion", "The reports has been generated to the output folder!")
 
-        # 找到第一個空白行
-        target_row = self.find_first_empty_row(source_sheet_master, basic_info_columns['Employee ID'])
+    def _show_error_message(self, error: Exception):
+        """顯示錯誤訊息"""
+        self._show_message('showerror', "Error",
+                           f"Error occurred：{str(error)}\nPlease check the log file for details.")
 
-        # 寫入員工基本資料
-        for field, col_index in basic_info_columns.items():
-            if col_index is not None:
-                source_sheet_master.cell(row=target_row, column=col_index + 1,
-                                       value=emp_info.get(field, ''))
+    def _show_message(self, kind: str, title: str, message: str):
+        """以 tkinter 對話框顯示訊息，無法建立視窗時 (如無圖形介面) 只記錄日誌"""
+        try:
+            import tkinter as tk
+            from tkinter import messagebox
 
-        # 寫入統計資料
-        for field, col_index in stat_columns.items():
-            if col_index is not None:
-                source_sheet_master.cell(row=target_row, column=col_index + 1,
-                                       value=self.monthly_counters.get(field, 0))
+            root = tk.Tk()
+            root.withdraw()
+            getattr(messagebox, kind)(title, message)
+        except Exception as e:
+            self.logger.warning(f"⚠️ 無法顯示對話框 ({title}): {str(e)}")
 
 
-    def _show_completion_message(self):
-        """顯示完成訊息"""
-        root = tk.Tk()
-        root.withdraw()
-        messagebox.showinfo("Completion", "The reports has been generated to the output folder!")
+_worker_processor: Optional[AttendanceProcessor] = None
+
+
+def _init_department_worker(processor: AttendanceProcessor):
+    """子行程初始化：保存處理器並接上同一個日誌檔"""
+    global _worker_processor
+    processor.logger = processor._setup_logging()
+    _worker_processor = processor
+
+
+def _process_department_worker(task: tuple) -> tuple:
+    """子行程處理單一部門"""
+    return _worker_processor._process_department(*task)
 
 
-def main():
-    """主程式入口"""
-    processor = AttendanceProcessor()
+def _month_name(value: str) -> str:
+    """報表月份參數：接受 YYYY-MM 或月份名稱 (如 June)"""
+    try:
+        return datetime.strptime(value, '%Y-%m').strftime('%B')
+    except ValueError:
+        return value
 
-    for step in tqdm(range(2), desc="🚀 處理中..."):
-        if step == 0:
-            processor._load_data()
-        elif step == 1:
-            processor._process_attendance_data()
 
-    processor._show_completion_message()
+def _batch_inputs(paths: list) -> list:
+    """批次輸入：資料夾展開為其中的 .xlsx 檔 (略過 Excel 暫存檔)"""
+    inputs = []
+    for path in paths:
+        if path.is_dir():
+            inputs.extend(sorted(file for file in path.glob('*.xlsx') if not file.name.startswith('~$')))
+        else:
+            inputs.append(path)
+    return inputs
+
+
+def _archive_inputs(paths: list) -> list:
+    """封存檔輸入：資料夾展開為其中的 .csv / .parquet 檔"""
+    inputs = []
+    for path in paths:
+        if path.is_dir():
+            inputs.extend(sorted(file for file in path.iterdir()
+                                 if file.suffix.lower() in AttendanceProcessor.ARCHIVE_SUFFIXES))
+        else:
+            inputs.append(path)
+    return inputs
+
+
+def _punch_inputs(paths: list) -> list:
+    """打卡紀錄輸入：資料夾展開為其中的 .csv 檔"""
+    inputs = []
+    for path in paths:
+        if path.is_dir():
+            inputs.extend(sorted(path.glob('*.csv')))
+        else:
+            inputs.append(path)
+    return inputs
+
+
+def parse_args(argv: Optional[list] = None) -> argparse.Namespace:
+    """解析命令列參數"""
+    parser = argparse.ArgumentParser(description="AttendEase 考勤報表產生器")
+    parser.add_argument('--input', type=Path, nargs='+',
+                        help="masterdata 檔案路徑 (預設 data/masterdata.xlsx)；"
+                             "批次模式可指定多個檔案或資料夾 (預設 data 資料夾)")
+    parser.add_argument('--template-dir', type=Path, help="模板資料夾 (預設 template)")
+    parser.add_argument('--output-dir', type=Path, help="報表輸出資料夾 (預設 output)")
+    parser.add_argument('--log-dir', type=Path, help="日誌資料夾 (預設 log)")
+    parser.add_argument('--month',
+                        help="報表檔名使用的月份，YYYY-MM 或月份名稱 (預設為執行當下月份)；"
+                             "批次模式下只處理該月份")
+    parser.add_argument('--batch', action='store_true',
+                        help="批次模式：依 Date 所屬月份分割各 masterdata，"
+                             "報表輸出至 <output>/<YYYY-MM>/<廠區>/")
+    parser.add_argument('--archive', type=Path, nargs='+',
+                        help="封存模式：分批讀取多年度考勤 CSV / Parquet (檔案或資料夾)，員工等其他資料取自 --input，"
+                             "每月統計輸出至 <output>/archive/<YYYY-MM>_Master_Report.xlsx")
+    parser.add_argument('--chunk-rows', type=int, default=AttendanceProcessor.ARCHIVE_CHUNK_ROWS,
+                        help=f"封存模式及打卡紀錄每批讀取的列數 (預設 {AttendanceProcessor.ARCHIVE_CHUNK_ROWS})")
+    parser.add_argument('--punches', type=Path, nargs='+',
+                        help="由終端機原始打卡紀錄 CSV (Employee ID, Timestamp) 產生考勤資料 (檔案或資料夾)，"
+                             "取代 masterdata 的 Attendance 工作表")
+    parser.add_argument('--export', nargs='+', default=['xlsx'],
+                        choices=list(AttendanceProcessor.EXPORT_FORMATS),
+                        help="輸出格式，可指定多個 (預設 xlsx 模板報表)：csv / parquet 輸出每日明細及主報表數據，"
+                             "xlsx-data 為不含模板格式的資料活頁簿")
+    parser.add_argument('--headless', action='store_true',
+                        help="無圖形介面模式：不顯示對話框及進度條，以結束碼回報結果 "
+                             "(Linux 無 DISPLAY 時自動啟用)")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="平行處理部門的行程數 (預設 1，循序處理)")
+    parser.add_argument('--streaming', action='store_true',
+                        help="以串流 (write-only) 模式寫出部門報表，記憶體用量以單一工作表為上限")
+    parser.add_argument('--save-queue', type=int, default=AttendanceProcessor.SAVE_QUEUE_SIZE,
+                        help="循序處理部門時於背景執行緒存檔，最多幾本活頁簿等待存檔 "
+                             f"(預設 {AttendanceProcessor.SAVE_QUEUE_SIZE}，0 為不使用背景存檔)")
+    parser.add_argument('--incremental', action='store_true',
+                        help="增量執行：只重建輸入資料有變動的員工及部門報表")
+    parser.add_argument('--profile', action='store_true',
+                        help="以 cProfile 分析本次執行，結果寫入 log 資料夾 (多行程時僅分析主行程)")
+    parser.add_argument('--no-cache', action='store_true',
+                        help="不使用 masterdata 解析快取，強制重新讀取 Excel")
+    args = parser.parse_args(argv)
+
+    if not args.batch and args.input and len(args.input) > 1:
+        parser.error("multiple --input files require --batch")
+    if args.archive and args.batch:
+        parser.error("--archive cannot be combined with --batch")
+    if args.punches and (args.batch or args.archive):
+        parser.error("--punches cannot be combined with --batch or --archive")
+    if args.save_queue < 0:
+        parser.error("--save-queue must not be negative")
+    if args.chunk_rows < 1:
+        parser.error("--chunk-rows must be at least 1")
+    if not args.headless and sys.platform.startswith('linux') and not os.environ.get('DISPLAY'):
+        args.headless = True
+    return args
+
+
+def main(argv: Optional[list] = None) -> int:
+    """主程式入口，回傳結束碼 (0 成功、1 處理失敗、3 找不到輸入檔或模板)"""
+    args = parse_args(argv)
+    try:
+        processor = AttendanceProcessor(input_file=args.input[0] if args.input else None,
+                                        template_dir=args.template_dir, output_dir=args.output_dir,
+                                        log_dir=args.log_dir,
+                                        month=None if args.batch or args.archive or not args.month
+                                        else _month_name(args.month))
+    except (OSError, ValueError) as e:
+        # 班別規則設定錯誤等初始化失敗
+        logging.getLogger(__name__).error(f"❌ 初始化失敗: {str(e)}")
+        return EXIT_FAILURE
+    show_gui = not args.headless
+
+    if args.batch:
+        inputs = _batch_inputs(args.input or [processor.input_file.parent])
+    elif args.archive:
+        inputs = [processor.input_file, *_archive_inputs(args.archive)]
+    elif args.punches:
+        inputs = [processor.input_file, *_punch_inputs(args.punches)]
+    else:
+        inputs = [processor.input_file]
+    required = list(inputs)
+    if args.archive or 'xlsx' in args.export:
+        # 只輸出資料表時不需要模板
+        required += [processor.template_dir / processor.EMPLOYEE_TEMPLATE_FILE,
+                     processor.template_dir / processor.MASTER_TEMPLATE_FILE]
+    missing = [str(path) for path in required if not path.exists()]
+    if not inputs:
+        missing.append(str(args.input or processor.input_file.parent))
+    elif (args.archive or args.punches) and len(inputs) == 1:
+        missing.extend(str(path) for path in args.archive or args.punches)
+    if missing:
+        processor.logger.error(f"❌ 找不到檔案: {', '.join(missing)}")
+        if show_gui:
+            processor._show_error_message(FileNotFoundError(', '.join(missing)))
+        return EXIT_MISSING_INPUT
+
+    profiler = cProfile.Profile() if args.profile else None
+    if profiler:
+        profiler.enable()
+
+    try:
+        if args.batch:
+            processor.process_batch(inputs, use_cache=not args.no_cache, workers=args.workers,
+                                    streaming=args.streaming, incremental=args.incremental,
+                                    month=args.month, export_formats=args.export,
+                                    save_queue=args.save_queue)
+        elif args.archive:
+            processor.process_archive(inputs[1:], use_cache=not args.no_cache,
+                                      chunk_rows=args.chunk_rows, month=args.month)
+        else:
+            steps = range(2)
+            if show_gui:
+                from tqdm import tqdm
+                steps = tqdm(steps, desc="🚀 處理中...")
+
+            for step in steps:
+                if step == 0:
+                    processor._load_data(use_cache=not args.no_cache, punch_files=inputs[1:],
+                                         chunk_rows=args.chunk_rows)
+                elif step == 1:
+                    processor._process_attendance_data(workers=args.workers, streaming=args.streaming,
+                                                       incremental=args.incremental,
+                                                       export_formats=args.export,
+                                                       save_queue=args.save_queue)
+    except Exception as e:
+        processor.logger.error(f"❌ 處理過程中發生錯誤: {str(e)}")
+        processor.logger.error(traceback.format_exc())
+        if show_gui:
+            processor._show_error_message(e)
+        return EXIT_FAILURE
+    finally:
+        if profiler:
+            profiler.disable()
+            processor._write_profile(profiler)
+
+    processor.logger.info(f"✅ 報表已輸出至 {processor.output_dir}")
+    if show_gui:
+        processor._show_completion_message()
+    return EXIT_SUCCESS
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    # PyInstaller 打包後在 Windows 使用多行程時需要
+    multiprocessing.freeze_support()
+    sys.exit(main())
\ No newline at end of file